@@ -0,0 +1,172 @@
+# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from shutil import rmtree
+import json
+import os
+import re
+
+from eolie.adblock_index import host_suffixes
+
+
+def parse_cosmetic_filter(line):
+    """
+        Parse an Adblock Plus element hiding filter
+        Extended filters (#?#, #$#) are not supported
+        @param line as str
+        @return (domains as [str], excluded as [str],
+                 selector as str, exception as bool) or None
+    """
+    match = re.match(r"^([^#]*)#(@?)#(.+)$", line.strip())
+    if match is None:
+        return None
+    (domains, exception, selector) = match.groups()
+    # uBlock scriptlets
+    if selector.startswith("+js("):
+        return None
+    # Do not let a selector close our rule
+    if "{" in selector or "}" in selector:
+        return None
+    included = []
+    excluded = []
+    for domain in domains.lower().split(","):
+        domain = domain.strip()
+        if domain.startswith("~"):
+            excluded.append(domain[1:])
+        elif domain:
+            included.append(domain)
+    return (included, excluded, selector, exception == "@")
+
+
+class AdblockCss:
+    """
+        Compiled element hiding filters
+        Directory layout:
+        - _generic.css: selectors for all sites
+        - _exceptions.json: generic selectors with their excluded sites
+        - <domain>.css: selectors for domain and its subdomains
+        "_" is not valid in a host name, so names never clash
+    """
+    __GENERIC = "_generic.css"
+    __EXCEPTIONS = "_exceptions.json"
+    __RULE = "%s { display: none !important; }\n"
+
+    def write(path, lines):
+        """
+            Compile filter lines to path, directory is replaced
+            @param path as str
+            @param lines as iterable of str
+        """
+        generic = set()
+        domains = {}
+        # Generic selector: sites it must not apply to
+        excluded = {}
+        # Domain: selectors it must not apply to
+        exceptions = {}
+        for line in lines:
+            cosmetic = parse_cosmetic_filter(line)
+            if cosmetic is None:
+                continue
+            (included, negated, selector, exception) = cosmetic
+            if exception:
+                for domain in included or [""]:
+                    exceptions.setdefault(domain, set()).add(selector)
+            elif included:
+                # Negated subdomains are not supported, keep rule
+                for domain in included:
+                    domains.setdefault(domain, set()).add(selector)
+            else:
+                generic.add(selector)
+                if negated:
+                    excluded.setdefault(selector, set()).update(negated)
+        # Generic exceptions disable selector everywhere
+        generic -= exceptions.pop("", set())
+        for (domain, selectors) in exceptions.items():
+            if domain in domains:
+                domains[domain] -= selectors
+            for selector in selectors:
+                if selector in generic:
+                    excluded.setdefault(selector, set()).add(domain)
+        generic -= set(excluded.keys())
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            rmtree(tmp)
+        os.makedirs(tmp)
+        AdblockCss.__write_css(os.path.join(tmp, AdblockCss.__GENERIC),
+                               generic)
+        with open(os.path.join(tmp, AdblockCss.__EXCEPTIONS), "w",
+                  encoding="utf-8") as f:
+            json.dump({selector: sorted(sites)
+                       for (selector, sites) in excluded.items()}, f)
+        for (domain, selectors) in domains.items():
+            if selectors and "/" not in domain:
+                AdblockCss.__write_css(os.path.join(tmp, domain + ".css"),
+                                       selectors)
+        old = path + ".old"
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        if os.path.exists(old):
+            rmtree(old)
+
+    def __init__(self, path):
+        """
+            Read compiled filters at path
+            @param path as str
+        """
+        self.__path = path
+        with open(os.path.join(path, self.__EXCEPTIONS), "r",
+                  encoding="utf-8") as f:
+            self.__excluded = json.load(f)
+
+    def get_generic(self):
+        """
+            Get stylesheet for all sites
+            @return str
+        """
+        with open(os.path.join(self.__path, self.__GENERIC), "r",
+                  encoding="utf-8") as f:
+            return f.read()
+
+    def get_domain(self, host):
+        """
+            Get stylesheet for host, to add to generic one
+            @param host as str
+            @return str
+        """
+        css = ""
+        suffixes = list(host_suffixes(host))
+        for suffix in suffixes:
+            try:
+                with open(os.path.join(self.__path, suffix + ".css"), "r",
+                          encoding="utf-8") as f:
+                    css += f.read()
+            except FileNotFoundError:
+                pass
+        for (selector, sites) in self.__excluded.items():
+            if not set(suffixes).intersection(sites):
+                css += self.__RULE % selector
+        return css
+
+#######################
+# PRIVATE             #
+#######################
+    def __write_css(path, selectors):
+        """
+            Write one rule per selector: an invalid selector in a group
+            would drop the whole rule
+            @param path as str
+            @param selectors as iterable of str
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            for selector in sorted(selectors):
+                f.write(AdblockCss.__RULE % selector)
@@ -0,0 +1,562 @@
+# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from urllib.parse import urlparse
+from struct import Struct
+from bisect import bisect_left
+from zlib import crc32
+import mmap
+import os
+import re
+
+from eolie.adblock_index import host_suffixes
+
+
+def is_network_filter(line):
+    """
+        True if line is an Adblock Plus network filter
+        @param line as str
+        @return bool
+    """
+    line = line.strip()
+    if not line or line[0] in "![":
+        return False
+    # Cosmetic filters: ##, #@#, #?#, #$#
+    return re.search(r"#[@?$]?#", line) is None
+
+
+def get_base_domain(host):
+    """
+        Get base domain for host, no public suffix list, just a heuristic
+        @param host as str
+        @return str
+    """
+    labels = host.split(".")
+    # example.co.uk, example.com.au
+    if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def parse_filter(line):
+    """
+        Parse an Adblock Plus network filter
+        @param line as str
+        @return (Filter, exception as bool) or None if unsupported
+    """
+    line = line.strip().lower()
+    if not is_network_filter(line):
+        return None
+    exception = line.startswith("@@")
+    if exception:
+        line = line[2:]
+    options = []
+    if "$" in line:
+        (line, options) = line.rsplit("$", 1)
+        options = options.split(",")
+    # Regex filters are way too slow
+    if line.startswith("/") and line.endswith("/") and len(line) > 1:
+        return None
+    domain = line.startswith("||")
+    if domain:
+        line = line[2:]
+    start = not domain and line.startswith("|")
+    if start:
+        line = line[1:]
+    end = line.endswith("|")
+    if end:
+        line = line[:-1]
+    # Wildcards on unanchored boundaries are useless
+    line = re.sub(r"\*+", "*", line)
+    if not start and not domain:
+        line = line.lstrip("*")
+    if not end:
+        line = line.rstrip("*")
+    if not line or line == "*":
+        return None
+    rule = Filter(line, start, end, domain)
+    for option in options:
+        if not rule.set_option(option, exception):
+            return None
+    return (rule, exception)
+
+
+class Filter:
+    """
+        A network filter, regex is compiled on first use
+    """
+    # ABP separator: anything but a letter, a digit, or _ - . %
+    __SEPARATOR = r"(?:[^\w.%-]|$)"
+    __DOMAIN_ANCHOR = r"^[a-z][a-z0-9+.-]*:/+(?:[^/?#]*\.)?"
+    __TOKEN = re.compile(r"[a-z0-9%]+")
+    __TYPES = {"script": "script", "image": "image",
+               "stylesheet": "stylesheet", "font": "font",
+               "media": "media", "object": "object",
+               "xmlhttprequest": "xmlhttprequest",
+               "subdocument": "subdocument", "other": "other"}
+
+    def __init__(self, pattern, start, end, domain):
+        """
+            Init filter
+            @param pattern as str, without anchors and options
+            @param start as bool, anchored to uri start
+            @param end as bool, anchored to uri end
+            @param domain as bool, anchored to a domain name
+        """
+        self.__pattern = pattern
+        self.__start = start
+        self.__end = end
+        self.__domain = domain
+        self.__regex = None
+        self.third_party = None
+        self.types = set()
+        self.excluded_types = set()
+        self.domains = []
+        self.excluded_domains = []
+        self.document = False
+
+    def set_option(self, option, exception):
+        """
+            Set filter option
+            @param option as str
+            @param exception as bool
+            @return False if option is not supported
+        """
+        negated = option.startswith("~")
+        name = option[1:] if negated else option
+        if name == "third-party":
+            self.third_party = not negated
+        elif name in self.__TYPES:
+            if negated:
+                self.excluded_types.add(self.__TYPES[name])
+            else:
+                self.types.add(self.__TYPES[name])
+        elif name.startswith("domain=") and not negated:
+            for domain in name[7:].split("|"):
+                if domain.startswith("~"):
+                    self.excluded_domains.append(domain[1:])
+                elif domain:
+                    self.domains.append(domain)
+        elif name == "document" and exception and not negated:
+            self.document = True
+        elif name == "match-case":
+            pass
+        else:
+            return False
+        return True
+
+    def get_tokens(self):
+        """
+            Get complete tokens in pattern: a token next to a wildcard or
+            an unanchored boundary may be part of a longer uri token
+            @return [str]
+        """
+        tokens = []
+        pattern = self.__pattern
+        for match in self.__TOKEN.finditer(pattern):
+            (begin, stop) = match.span()
+            if begin == 0 and not (self.__start or self.__domain):
+                continue
+            if stop == len(pattern) and not self.__end:
+                continue
+            if pattern[begin - 1:begin] == "*" or\
+                    pattern[stop:stop + 1] == "*":
+                continue
+            tokens.append(match.group())
+        return tokens
+
+    def match(self, uri):
+        """
+            True if pattern matches uri
+            @param uri as str, lowercased
+            @return bool
+        """
+        if self.__regex is None:
+            self.__regex = re.compile(self.__get_regex())
+        return self.__regex.search(uri) is not None
+
+    def match_context(self, resource_type, third_party, page_host):
+        """
+            True if options match request context
+            @param resource_type as str/None
+            @param third_party as bool/None
+            @param page_host as str/None
+            @return bool
+        """
+        if self.third_party is not None and third_party is not None and\
+                self.third_party != third_party:
+            return False
+        if self.types and resource_type not in self.types:
+            return False
+        if resource_type in self.excluded_types:
+            return False
+        if self.domains or self.excluded_domains:
+            if page_host is None:
+                return not self.domains
+            suffixes = set(host_suffixes(page_host))
+            if suffixes.intersection(self.excluded_domains):
+                return False
+            if self.domains and not suffixes.intersection(self.domains):
+                return False
+        return True
+
+#######################
+# PRIVATE             #
+#######################
+    def __get_regex(self):
+        """
+            Translate pattern to a regex
+            @return str
+        """
+        regex = ""
+        for c in self.__pattern:
+            if c == "*":
+                regex += ".*"
+            elif c == "^":
+                regex += self.__SEPARATOR
+            else:
+                regex += re.escape(c)
+        if self.__domain:
+            regex = self.__DOMAIN_ANCHOR + regex
+        elif self.__start:
+            regex = "^" + regex
+        if self.__end:
+            regex += "$"
+        return regex
+
+
+class AdblockFilters:
+    """
+        Read only view on compiled Adblock Plus/EasyList network filters
+        Each filter is indexed by one of its tokens, a request is only
+        checked against filters sharing a token with its uri
+        Filters without a complete token are indexed by their domain=
+        option, remaining ones are checked on every request
+        File layout (little endian):
+        - header: magic, version, bucket bits, filters count,
+          scanned filters count, entries count
+        - buckets: (1 << bucket bits) + 1 uint32 offsets in entries
+        - entries: sorted uint64, key crc32 << 32 | filter offset in lines
+        - lines: filters, one per line, parsed on first use
+        Web processes map this file, so they all share one page cache copy
+    """
+    __MAGIC = b"EOLIEAFL"
+    __VERSION = 1
+    __BUCKET_BITS = 12
+    # Uri tokens a browsing session keeps meeting
+    __KEYS_SIZE = 16384
+    __HEADER = Struct("<8sIIIII")
+    __OFFSET = Struct("<I")
+    __ENTRY = Struct("<Q")
+    __TOKEN = re.compile(r"[a-z0-9%]+")
+    # Tokens found in almost every uri
+    __COMMON_TOKENS = ["http", "https", "www", "com", "net", "org",
+                       "html", "js", "css"]
+    # Keys are never valid tokens: token characters are [a-z0-9%]
+    __EXCEPTION = "@@"
+    __DOMAIN = "domain="
+    __DOCUMENT = "$document"
+    # No resource type from WebKit send-request, guess it from extension
+    __EXTENSIONS = {"js": "script", "mjs": "script",
+                    "css": "stylesheet",
+                    "png": "image", "jpg": "image", "jpeg": "image",
+                    "gif": "image", "webp": "image", "svg": "image",
+                    "ico": "image", "bmp": "image",
+                    "woff": "font", "woff2": "font", "ttf": "font",
+                    "otf": "font", "eot": "font",
+                    "mp4": "media", "webm": "media", "mp3": "media",
+                    "ogg": "media", "m4a": "media",
+                    "swf": "object"}
+
+    def write(path, lines):
+        """
+            Compile filters to path, file is atomically replaced
+            Unsupported filters are ignored
+            @param path as str
+            @param lines as iterable of str
+            @return (filters count as int, scanned filters count as int),
+                    scanned filters are checked on every request
+        """
+        content = bytearray()
+        keys = {}
+        entries = []
+        count = 0
+        scanned = 0
+        for line in lines:
+            parsed = parse_filter(line)
+            if parsed is None:
+                continue
+            (rule, exception) = parsed
+            prefix = AdblockFilters.__EXCEPTION if exception else ""
+            if rule.document:
+                rule_keys = [AdblockFilters.__DOCUMENT]
+            else:
+                token = AdblockFilters.__get_best_token(rule, prefix, keys)
+                if token is not None:
+                    rule_keys = [prefix + token]
+                elif rule.domains:
+                    rule_keys = [prefix + AdblockFilters.__DOMAIN + domain
+                                 for domain in set(rule.domains)]
+                else:
+                    rule_keys = [prefix]
+                    scanned += 1
+            for key in rule_keys:
+                keys[key] = keys.get(key, 0) + 1
+                value = AdblockFilters.__get_key_hash(key)
+                entries.append((value << 32) | len(content))
+            content += line.strip().lower().encode("utf-8") + b"\n"
+            count += 1
+        entries.sort()
+        shift = 64 - AdblockFilters.__BUCKET_BITS
+        buckets = [bisect_left(entries, bucket << shift)
+                   for bucket in range(1 << AdblockFilters.__BUCKET_BITS)]
+        buckets.append(len(entries))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(AdblockFilters.__HEADER.pack(AdblockFilters.__MAGIC,
+                                                 AdblockFilters.__VERSION,
+                                                 AdblockFilters.__BUCKET_BITS,
+                                                 count,
+                                                 scanned,
+                                                 len(entries)))
+            f.write(Struct("<%sI" % len(buckets)).pack(*buckets))
+            f.write(Struct("<%sQ" % len(entries)).pack(*entries))
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        # Mapped readers keep the old inode until they reload
+        os.replace(tmp, path)
+        return (count, scanned)
+
+    def __init__(self, path):
+        """
+            Map compiled file at path
+            @param path as str
+            @raise ValueError if file is invalid
+        """
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, bits, self.__count,
+         self.__scanned, self.__entries_count) = self.__HEADER.unpack_from(
+                                                                self.__map, 0)
+        if magic != self.__MAGIC or version != self.__VERSION:
+            self.__map.close()
+            raise ValueError("Invalid adblock filters: %s" % path)
+        self.__shift = 32 - bits
+        self.__buckets = self.__HEADER.size
+        self.__entries = self.__buckets + ((1 << bits) + 1) * 4
+        self.__lines = self.__entries + self.__entries_count * 8
+        if len(self.__map) < self.__lines:
+            self.__map.close()
+            raise ValueError("Truncated adblock filters: %s" % path)
+        # Filter offset: Filter, only filters met so far
+        self.__rules = {}
+        # Key: (Filter, ...), cleared when full
+        self.__keys = {}
+        self.__page = (None, None)
+
+    def is_blocked(self, uri, page_uri=None):
+        """
+            True if uri is blocked by a filter and not by an exception
+            @param uri as str
+            @param page_uri as str/None
+            @return bool
+        """
+        if not self.__count:
+            return False
+        uri = uri.lower()
+        page_host = None
+        if page_uri is not None:
+            page_uri = page_uri.lower()
+            # Main document is never blocked
+            if uri == page_uri:
+                return False
+            page_host = self.__get_page_host(page_uri)
+        keys = set(self.__TOKEN.findall(uri))
+        # Filters without a usable token are indexed on empty token
+        keys.add("")
+        if page_host is not None:
+            keys.update(self.__DOMAIN + suffix
+                        for suffix in host_suffixes(page_host))
+        parse = urlparse(uri)
+        third_party = None
+        if parse.hostname is not None and page_host is not None:
+            third_party = get_base_domain(parse.hostname) !=\
+                get_base_domain(page_host)
+        resource_type = self.__get_resource_type(parse.path)
+        if not self.__match(keys, "", uri,
+                            resource_type, third_party, page_host):
+            return False
+        if self.__match(keys, self.__EXCEPTION, uri,
+                        resource_type, third_party, page_host):
+            return False
+        if page_uri is not None:
+            for rule in self.__get_rules(self.__DOCUMENT):
+                if rule.match(page_uri):
+                    return False
+        return True
+
+    def close(self):
+        """
+            Unmap file
+        """
+        self.__map.close()
+
+    def __len__(self):
+        """
+            Filters count
+            @return int
+        """
+        return self.__count
+
+    @property
+    def scanned(self):
+        """
+            Get count of filters checked on every request
+            @return int
+        """
+        return self.__scanned
+
+#######################
+# PRIVATE             #
+#######################
+    def __get_key_hash(key):
+        """
+            Get hash for index key
+            @param key as str
+            @return int
+        """
+        return crc32(key.encode("utf-8"))
+
+    def __get_best_token(rule, prefix, keys):
+        """
+            Get less used complete token for rule
+            @param rule as Filter
+            @param prefix as str, prepended to keys
+            @param keys as {str: int}, filters count per key
+            @return str/None
+        """
+        best = None
+        best_score = None
+        for token in rule.get_tokens():
+            score = (token in AdblockFilters.__COMMON_TOKENS,
+                     keys.get(prefix + token, 0),
+                     -len(token))
+            if best_score is None or score < best_score:
+                best = token
+                best_score = score
+        return best
+
+    def __match(self, keys, prefix, uri, resource_type,
+                third_party, page_host):
+        """
+            True if a filter indexed by one of keys matches uri
+            @param keys as set of str
+            @param prefix as str, prepended to keys
+            @param uri as str
+            @param resource_type as str/None
+            @param third_party as bool/None
+            @param page_host as str/None
+            @return bool
+        """
+        for key in keys:
+            for rule in self.__get_rules(prefix + key):
+                if rule.match_context(resource_type, third_party, page_host)\
+                        and rule.match(uri):
+                    return True
+        return False
+
+    def __get_rules(self, key):
+        """
+            Get filters indexed by key, may contain a few filters from
+            other keys on hash collisions, they just never match
+            @param key as str
+            @return (Filter, ...)
+        """
+        rules = self.__keys.get(key)
+        if rules is None:
+            if len(self.__keys) >= self.__KEYS_SIZE:
+                self.__keys.clear()
+            rules = tuple(self.__read_rules(key))
+            self.__keys[key] = rules
+        return rules
+
+    def __read_rules(self, key):
+        """
+            Read filters indexed by key from map
+            @param key as str
+            @return iterator of Filter
+        """
+        value = AdblockFilters.__get_key_hash(key)
+        offset = self.__buckets + (value >> self.__shift) * 4
+        lo = self.__OFFSET.unpack_from(self.__map, offset)[0]
+        hi = self.__OFFSET.unpack_from(self.__map, offset + 4)[0]
+        # Find first entry for key hash
+        target = value << 32
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__get_entry(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.__entries_count:
+            entry = self.__get_entry(lo)
+            if entry >> 32 != value:
+                break
+            yield self.__get_rule(entry & 0xffffffff)
+            lo += 1
+
+    def __get_entry(self, index):
+        """
+            Get entry at index
+            @param index as int
+            @return int
+        """
+        return self.__ENTRY.unpack_from(self.__map,
+                                        self.__entries + index * 8)[0]
+
+    def __get_rule(self, offset):
+        """
+            Get filter at offset in lines, parse it on first use
+            @param offset as int
+            @return Filter
+        """
+        rule = self.__rules.get(offset)
+        if rule is None:
+            start = self.__lines + offset
+            end = self.__map.find(b"\n", start)
+            line = self.__map[start:end].decode("utf-8")
+            rule = parse_filter(line)[0]
+            self.__rules[offset] = rule
+        return rule
+
+    def __get_page_host(self, page_uri):
+        """
+            Get host for page uri, last one is cached as requests come
+            from the same page
+            @param page_uri as str
+            @return str/None
+        """
+        if self.__page[0] != page_uri:
+            self.__page = (page_uri, urlparse(page_uri).hostname)
+        return self.__page[1]
+
+    def __get_resource_type(self, path):
+        """
+            Guess resource type from uri path extension
+            @param path as str
+            @return str/None
+        """
+        dot = path.rfind(".")
+        if dot == -1 or "/" in path[dot:]:
+            return None
+        return self.__EXTENSIONS.get(path[dot + 1:])
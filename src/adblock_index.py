@@ -0,0 +1,161 @@
+# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from hashlib import blake2b
+from struct import Struct
+from bisect import bisect_left
+import mmap
+import os
+
+
+def host_hash(host):
+    """
+        Return a stable 64 bits hash for host
+        @param host as str
+        @return int
+    """
+    return int.from_bytes(blake2b(host.encode("utf-8"),
+                                  digest_size=8).digest(), "little")
+
+
+def host_suffixes(host):
+    """
+        Yield host and its parent domains, top level domain excepted
+        Cost is proportional to the number of labels in host
+        @param host as str
+        @return iterator of str
+    """
+    yield host
+    # Do not walk up ip addresses
+    if not host or host[-1].isdigit():
+        return
+    dot = host.find(".")
+    while dot != -1:
+        parent = host[dot + 1:]
+        dot = host.find(".", dot + 1)
+        if dot != -1:
+            yield parent
+
+
+class AdblockIndex:
+    """
+        Read only view on a compiled adblock blocklist
+        File layout (little endian):
+        - header: magic, version, bucket bits, generation, count
+        - buckets: (1 << bucket bits) + 1 uint32 offsets in hashes
+        - hashes: count sorted uint64 host hashes
+        Web processes map this file, so they all share one page cache copy
+    """
+    __MAGIC = b"EOLIEADB"
+    __VERSION = 1
+    __BUCKET_BITS = 16
+    __HEADER = Struct("<8sIIQQ")
+    __OFFSET = Struct("<I")
+    __HASH = Struct("<Q")
+
+    def write(path, hosts, generation):
+        """
+            Compile hosts to path, file is atomically replaced
+            @param path as str
+            @param hosts as iterable of str
+            @param generation as int
+        """
+        hashes = sorted({host_hash(host) for host in hosts})
+        shift = 64 - AdblockIndex.__BUCKET_BITS
+        buckets = [bisect_left(hashes, bucket << shift)
+                   for bucket in range(1 << AdblockIndex.__BUCKET_BITS)]
+        buckets.append(len(hashes))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(AdblockIndex.__HEADER.pack(AdblockIndex.__MAGIC,
+                                               AdblockIndex.__VERSION,
+                                               AdblockIndex.__BUCKET_BITS,
+                                               generation,
+                                               len(hashes)))
+            f.write(Struct("<%sI" % len(buckets)).pack(*buckets))
+            f.write(Struct("<%sQ" % len(hashes)).pack(*hashes))
+            f.flush()
+            os.fsync(f.fileno())
+        # Mapped readers keep the old inode until they reload
+        os.replace(tmp, path)
+
+    def __init__(self, path):
+        """
+            Map compiled file at path
+            @param path as str
+            @raise ValueError if file is invalid
+        """
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, bits,
+         self.__generation, self.__count) = self.__HEADER.unpack_from(
+                                                                self.__map, 0)
+        if magic != self.__MAGIC or version != self.__VERSION:
+            self.__map.close()
+            raise ValueError("Invalid adblock index: %s" % path)
+        self.__shift = 64 - bits
+        self.__buckets = self.__HEADER.size
+        self.__hashes = self.__buckets + ((1 << bits) + 1) * 4
+        if len(self.__map) != self.__hashes + self.__count * 8:
+            self.__map.close()
+            raise ValueError("Truncated adblock index: %s" % path)
+
+    def __contains__(self, host):
+        """
+            True if host is in index
+            @param host as str
+            @return bool
+        """
+        return self.contains_hash(host_hash(host))
+
+    def __len__(self):
+        """
+            Hosts count
+            @return int
+        """
+        return self.__count
+
+    def contains_hash(self, value):
+        """
+            True if hash is in index
+            @param value as int
+            @return bool
+        """
+        offset = self.__buckets + (value >> self.__shift) * 4
+        lo = self.__OFFSET.unpack_from(self.__map, offset)[0]
+        hi = self.__OFFSET.unpack_from(self.__map, offset + 4)[0]
+        # Buckets are tiny, this is a couple of reads at most
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.__HASH.unpack_from(self.__map,
+                                              self.__hashes + mid * 8)[0]
+            if current == value:
+                return True
+            elif current < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def close(self):
+        """
+            Unmap file
+        """
+        self.__map.close()
+
+    @property
+    def generation(self):
+        """
+            Get generation index was compiled for
+            @return int
+        """
+        return self.__generation
@@ -17,6 +17,10 @@ gi.require_version('Soup', '2.4')
 from gi.repository import Gtk, Gio, GLib, Gdk, WebKit2
 
 from gettext import gettext as _
+from threading import Thread
+from urllib.parse import urlparse
+from collections import OrderedDict
+from uuid import uuid4
 
 from eolie.settings import Settings, SettingsDialog
 from eolie.window import Window
@@ -25,6 +29,8 @@ from eolie.database_history import DatabaseHistory
 from eolie.database_bookmarks import DatabaseBookmarks
 from eolie.database_adblock import DatabaseAdblock
 from eolie.sqlcursor import SqlCursor
+from eolie.define import AdblockStats
+from eolie.utils import debug
 from eolie.search import Search
 from eolie.downloads_manager import DownloadsManager
 
@@ -40,6 +46,8 @@ class Application(Gtk.Application):
         __LOCAL_PATH = GLib.getenv("XDG_DATA_HOME") + "/eolie"
     __COOKIES_PATH = "%s/cookies.db" % __LOCAL_PATH
     __FAVICONS_PATH = "%s/favicons" % __LOCAL_PATH
+    __CONTENT_FILTERS_PATH = "%s/content_filters" % __LOCAL_PATH
+    __STYLE_SHEETS_SIZE = 64
 
     def __init__(self, extension_dir):
         """
@@ -97,8 +105,38 @@ class Application(Gtk.Application):
         SqlCursor.add(self.history)
         SqlCursor.add(self.bookmarks)
         self.bookmarks.import_firefox()
-        adblock = DatabaseAdblock()
-        adblock.update()
+        self.adblock = DatabaseAdblock()
+        self.adblock.update(self.__on_adblock_updated)
+        # Page id: (requests seen, requests blocked, match time in us)
+        self.adblock_stats = {}
+        # Web extensions send statistics to this connection only, with a
+        # token other session bus clients do not know
+        self.__bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        self.__adblock_stats_token = uuid4().hex
+        self.__bus.signal_subscribe(None,
+                                    AdblockStats.INTERFACE,
+                                    AdblockStats.SIGNAL,
+                                    AdblockStats.PATH,
+                                    self.__adblock_stats_token,
+                                    Gio.DBusSignalFlags.NONE,
+                                    self.__on_adblock_stats)
+        self.__content_filters = []
+        self.__content_filter_store = None
+        self.__generic_style_sheet = None
+        # Host: UserStyleSheet, for recently visited sites
+        self.__style_sheets = OrderedDict()
+        # Web extensions filter requests until a content filter is attached
+        self.adblock.set_content_filtered(False)
+        # Let WebKit block ads
+        if self.settings.get_value('adblock-content-filter'):
+            self.__content_filter_store = WebKit2.UserContentFilterStore.new(
+                                                self.__CONTENT_FILTERS_PATH)
+            self.__content_filter_store.fetch_identifiers(
+                                        None,
+                                        self.__on_content_filter_identifiers,
+                                        True)
+            self.settings.connect('changed::adblock',
+                                  self.__on_adblock_changed)
         self.art = Art()
         self.search = Search()
         self.downloads_manager = DownloadsManager()
@@ -115,6 +153,10 @@ class Application(Gtk.Application):
         context = WebKit2.WebContext.get_default()
         GLib.setenv('PYTHONPATH', self.__extension_dir, True)
         context.set_web_extensions_directory(self.__extension_dir)
+        context.set_web_extensions_initialization_user_data(
+                                GLib.Variant("(ss)",
+                                             (self.__bus.get_unique_name(),
+                                              self.__adblock_stats_token)))
 
         data_manager = WebKit2.WebsiteDataManager()
         context.new_with_website_data_manager(data_manager)
@@ -151,11 +193,71 @@ class Application(Gtk.Application):
             window.show()
             self.__windows.append(window)
 
+    def set_content_filter(self, view):
+        """
+            Attach adblock content filter to view if adblock is enabled
+            @param view as WebView
+        """
+        # Content filters need WebKitGTK 2.24, only use them if wanted
+        if self.__content_filter_store is None:
+            return
+        manager = view.get_user_content_manager()
+        manager.remove_all_filters()
+        if self.settings.get_value('adblock'):
+            for content_filter in self.__content_filters:
+                manager.add_filter(content_filter)
+
+    def set_adblock_style_sheets(self, view):
+        """
+            Inject element hiding style sheets for view uri
+            @param view as WebView
+        """
+        manager = view.get_user_content_manager()
+        manager.remove_all_style_sheets()
+        uri = view.get_uri()
+        if not uri or not self.settings.get_value('adblock') or\
+                self.adblock.is_exception(uri):
+            return
+        host = urlparse(uri).hostname
+        if host is None:
+            return
+        style_sheet = self.__style_sheets.get(host)
+        if style_sheet is None:
+            css = self.adblock.get_css(host)
+            # Do not cache, filters may be available on next load
+            if css is None:
+                return
+            (generic, domain) = css
+            if self.__generic_style_sheet is None:
+                self.__generic_style_sheet = self.__get_style_sheet(generic)
+            style_sheet = self.__get_style_sheet(domain)
+            self.__style_sheets[host] = style_sheet
+            if len(self.__style_sheets) > self.__STYLE_SHEETS_SIZE:
+                self.__style_sheets.popitem(last=False)
+        else:
+            self.__style_sheets.move_to_end(host)
+        manager.add_style_sheet(self.__generic_style_sheet)
+        manager.add_style_sheet(style_sheet)
+
+    def set_adblock_exception(self, uri, exception):
+        """
+            Allow/block ads on uri site
+            @param uri as str
+            @param exception as bool
+        """
+        if exception:
+            self.adblock.add_exception(uri)
+        else:
+            self.adblock.remove_exception(uri)
+        if self.__content_filter_store is not None:
+            self.__save_content_filter()
+
     def prepare_to_exit(self, action=None, param=None, exit=True):
         """
             Save window position and view
         """
         self.downloads_manager.cancel()
+        self.history.flush()
         if exit:
             self.quit()
 
@@ -191,6 +293,193 @@ class Application(Gtk.Application):
 #######################
 # PRIVATE             #
 #######################
+    def __save_content_filter(self):
+        """
+            Compile adblock lists to a WebKit content filter
+        """
+        thread = Thread(target=self.__get_content_rules)
+        thread.daemon = True
+        thread.start()
+
+    def __get_content_rules(self):
+        """
+            Get content rules and save them to store in main loop
+        """
+        rulesets = self.adblock.get_content_rules()
+        GLib.idle_add(self.__save_content_filters, rulesets, [])
+
+    def __save_content_filters(self, rulesets, content_filters):
+        """
+            Save next ruleset to store, use content filters once all saved
+            @param rulesets as [str], not saved yet
+            @param content_filters as [WebKit2.UserContentFilter], saved
+        """
+        if not rulesets:
+            self.__set_content_filters(content_filters)
+            # Remove rulesets left by a longer blocklist
+            self.__content_filter_store.fetch_identifiers(
+                                        None,
+                                        self.__on_content_filter_identifiers,
+                                        False)
+            return
+        self.__content_filter_store.save(
+                                "adblock-%s" % len(content_filters),
+                                GLib.Bytes.new(rulesets[0].encode("utf-8")),
+                                None,
+                                self.__on_content_filter_saved,
+                                rulesets[1:],
+                                content_filters)
+
+    def __load_content_filters(self, identifiers, content_filters):
+        """
+            Load next content filter from store, use them once all loaded
+            @param identifiers as [str], not loaded yet
+            @param content_filters as [WebKit2.UserContentFilter], loaded
+        """
+        if not identifiers:
+            self.__set_content_filters(content_filters)
+            return
+        self.__content_filter_store.load(identifiers[0],
+                                         None,
+                                         self.__on_content_filter_loaded,
+                                         identifiers[1:],
+                                         content_filters)
+
+    def __set_content_filters(self, content_filters):
+        """
+            Attach content filters to views, web extensions filter requests
+            if there is none
+            @param content_filters as [WebKit2.UserContentFilter]
+        """
+        self.__content_filters = content_filters
+        self.__update_content_filters()
+        self.adblock.set_content_filtered(bool(content_filters))
+
+    def __get_style_sheet(self, css):
+        """
+            Get a user style sheet for all frames
+            @param css as str
+            @return WebKit2.UserStyleSheet
+        """
+        return WebKit2.UserStyleSheet(
+                                css,
+                                WebKit2.UserContentInjectedFrames.ALL_FRAMES,
+                                WebKit2.UserStyleLevel.USER,
+                                None,
+                                None)
+
+    def __update_content_filters(self):
+        """
+            Update content filter for all views
+        """
+        for window in self.__windows:
+            for view in window.container.views:
+                self.set_content_filter(view)
+
+    def __on_content_filter_identifiers(self, store, result, load):
+        """
+            Load stored content filters or remove unused ones
+            @param store as WebKit2.UserContentFilterStore
+            @param result as Gio.AsyncResult
+            @param load as bool
+        """
+        try:
+            identifiers = store.fetch_identifiers_finish(result)
+        except GLib.Error as e:
+            print("Application::__on_content_filter_identifiers():", e)
+            identifiers = []
+        if load:
+            count = 0
+            while "adblock-%s" % count in identifiers:
+                count += 1
+            if count:
+                self.__load_content_filters(
+                                ["adblock-%s" % i for i in range(count)], [])
+            else:
+                self.__save_content_filter()
+        else:
+            used = ["adblock-%s" % i
+                    for i in range(len(self.__content_filters))]
+            for identifier in identifiers:
+                if identifier.startswith("adblock") and\
+                        identifier not in used:
+                    store.remove(identifier, None, None)
+
+    def __on_content_filter_loaded(self, store, result,
+                                   identifiers, content_filters):
+        """
+            Load next stored content filter or compile new ones
+            @param store as WebKit2.UserContentFilterStore
+            @param result as Gio.AsyncResult
+            @param identifiers as [str]
+            @param content_filters as [WebKit2.UserContentFilter]
+        """
+        try:
+            content_filters.append(store.load_finish(result))
+            self.__load_content_filters(identifiers, content_filters)
+        except GLib.Error as e:
+            print("Application::__on_content_filter_loaded():", e)
+            self.__save_content_filter()
+
+    def __on_content_filter_saved(self, store, result,
+                                  rulesets, content_filters):
+        """
+            Save next ruleset
+            @param store as WebKit2.UserContentFilterStore
+            @param result as Gio.AsyncResult
+            @param rulesets as [str]
+            @param content_filters as [WebKit2.UserContentFilter]
+        """
+        try:
+            content_filters.append(store.save_finish(result))
+            self.__save_content_filters(rulesets, content_filters)
+        except GLib.Error as e:
+            print("Application::__on_content_filter_saved():", e,
+                  "- web extensions block ads")
+            self.__set_content_filters([])
+
+    def __on_adblock_updated(self):
+        """
+            Recompile content filter for new lists, drop style sheets
+        """
+        self.__generic_style_sheet = None
+        self.__style_sheets.clear()
+        if self.__content_filter_store is not None:
+            self.__save_content_filter()
+
+    def __on_adblock_stats(self, connection, sender, path,
+                           interface, signal, params):
+        """
+            Save adblock statistics sent by web extensions
+            @param connection as Gio.DBusConnection
+            @param sender as str
+            @param path as str
+            @param interface as str
+            @param signal as str
+            @param params as GLib.Variant
+        """
+        page_ids = [view.get_page_id() for window in self.__windows
+                    for view in window.container.views]
+        for (page_id, seen, blocked, match_us) in params[1]:
+            # View closed since
+            if page_id not in page_ids:
+                continue
+            self.adblock_stats[page_id] = (seen, blocked, match_us)
+            debug("Adblock: page %s, %s/%s blocked, %s us" %
+                  (page_id, blocked, seen, match_us))
+        for window in self.__windows:
+            view = window.container.current
+            if view is not None:
+                window.toolbar.end.update_adblock_stats(view)
+
+    def __on_adblock_changed(self, settings, key):
+        """
+            Attach/detach content filter
+            @param settings as Gio.Settings
+            @param key as str
+        """
+        self.__update_content_filters()
+
     def __on_command_line(self, app, app_cmd_line):
         """
             Handle command line
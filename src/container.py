@@ -13,7 +13,8 @@
 from gi.repository import Gtk, WebKit2
 
 from eolie.stacksidebar import StackSidebar
-from eolie.define import El
+from eolie.define import El, Transition
+from eolie.utils import get_canonical_uri
 
 
 class Container(Gtk.Paned):
@@ -77,13 +78,14 @@ class Container(Gtk.Paned):
             self.__stack.set_visible_child(view)
             self.__stack_sidebar.update_visible_child()
 
-    def load_uri(self, uri):
+    def load_uri(self, uri, transition=Transition.LINK):
         """
             Load uri in current view
             @param uri as str
+            @param transition as Transition
         """
         if self.current is not None:
-            self.current.load_uri(uri)
+            self.current.load_uri(uri, transition)
 
     @property
     def sidebar(self):
@@ -135,6 +137,7 @@ class Container(Gtk.Paned):
         """
         if view == self.current:
             self.window.toolbar.title.set_uri(view.get_uri())
+            self.window.toolbar.end.update_adblock_stats(view)
             if view.is_loading():
                 self.__progress.show()
             else:
@@ -185,9 +188,11 @@ class Container(Gtk.Paned):
                 self.window.toolbar.title.set_title(uri)
             self.window.toolbar.actions.set_actions(view)
         if title:
-            El().history.add(title, uri)
-            if uri != view.loaded_uri:
-                El().history.add(title, view.loaded_uri)
+            El().history.set_title(title, uri)
+            # Variants of loaded uri are the same history entry
+            if view.loaded_uri and get_canonical_uri(uri) !=\
+                    get_canonical_uri(view.loaded_uri):
+                El().history.set_title(title, view.loaded_uri)
 
     def __on_enter_fullscreen(self, view):
         """
@@ -212,11 +217,21 @@ class Container(Gtk.Paned):
 
     def __on_load_changed(self, view, event):
         """
-            Update sidebar/urlbar
+            Update sidebar/urlbar, record visits
             @param view as WebView
             @param event as WebKit2.LoadEvent
         """
         self.window.toolbar.title.on_load_changed(view, event)
+        # One visit per navigation, title comes later
+        if event == WebKit2.LoadEvent.COMMITTED:
+            uri = view.get_uri()
+            # Variants of loaded uri are the same history entry
+            if view.loaded_uri and get_canonical_uri(uri) !=\
+                    get_canonical_uri(view.loaded_uri):
+                El().history.queue(None, uri, Transition.REDIRECT)
+                El().history.queue(None, view.loaded_uri, view.transition)
+            else:
+                El().history.queue(None, uri, view.transition)
         if view == self.current:
             if event == WebKit2.LoadEvent.STARTED:
                 self.__progress.show()
@@ -13,11 +13,20 @@
 from gi.repository import Soup, Gio, GLib
 
 from urllib.parse import urlparse
+from os import stat
 import sqlite3
-from time import time, sleep
+import json
+import re
+from time import time
 from threading import Thread
+from itertools import chain
+from collections import OrderedDict
 
 from eolie.sqlcursor import SqlCursor
+from eolie.adblock_index import AdblockIndex, host_suffixes
+from eolie.adblock_filters import AdblockFilters, is_network_filter
+from eolie.adblock_css import AdblockCss
+from eolie.utils import debug
 
 
 class DatabaseAdblock:
@@ -29,12 +38,26 @@ class DatabaseAdblock:
     else:
         __LOCAL_PATH = GLib.getenv("XDG_DATA_HOME") + "/eolie"
     DB_PATH = "%s/adblock.db" % __LOCAL_PATH
+    INDEX_PATH = "%s/adblock.bin" % __LOCAL_PATH
+    FILTERS_PATH = "%s/adblock_filters.txt" % __LOCAL_PATH
+    FILTERS_INDEX_PATH = "%s/adblock_filters.bin" % __LOCAL_PATH
+    EXCEPTIONS_PATH = "%s/adblock_exceptions.txt" % __LOCAL_PATH
+    # Exists while a WebKit content filter is attached to views
+    CONTENT_FILTER_PATH = "%s/adblock_content_filter" % __LOCAL_PATH
+    CSS_PATH = "%s/adblock_css" % __LOCAL_PATH
+    __CACHE_PATH = "%s/adblock" % __LOCAL_PATH
+    # Hosts a browsing session keeps hitting: fonts, CDNs, analytics...
+    __VERDICTS_SIZE = 4096
+    # Older WebKitGTK refuse content filters with more rules
+    __CONTENT_RULES_SIZE = 50000
 
     __URIS = ["https://adaway.org/hosts.txt",
               "http://winhelp2002.mvps.org/hosts.txt",
               "http://hosts-file.net/ad_servers.txt",
               "https://pgl.yoyo.org/adservers/serverlist.php?"
               "hostformat=hosts&showintro=0&mimetype=plaintext"]
+    # Adblock Plus filter lists
+    __FILTERS_URIS = ["https://easylist.to/easylist/easylist.txt"]
 
     # SQLite documentation:
     # In SQLite, a column with type INTEGER PRIMARY KEY
@@ -46,37 +69,78 @@ class DatabaseAdblock:
                                                dns TEXT NOT NULL,
                                                mtime INT NOT NULL
                                                )'''
+    __create_adblock_idx = '''CREATE UNIQUE INDEX IF NOT EXISTS
+                                idx_adblock_dns ON adblock(dns)'''
+    # HTTP validators and checksum of last ingested lists
+    __create_sources = '''CREATE TABLE IF NOT EXISTS sources (
+                                               id INTEGER PRIMARY KEY,
+                                               uri TEXT NOT NULL UNIQUE,
+                                               etag TEXT,
+                                               modified TEXT,
+                                               checksum TEXT
+                                               )'''
+    # Bumped each time adblock table content changes
+    __create_generation = '''CREATE TABLE IF NOT EXISTS generation (
+                                               id INTEGER PRIMARY KEY,
+                                               value INT NOT NULL
+                                               )'''
+    # Sites user allowed ads on
+    __create_exceptions = '''CREATE TABLE IF NOT EXISTS exceptions (
+                                               id INTEGER PRIMARY KEY,
+                                               site TEXT NOT NULL UNIQUE
+                                               )'''
 
-    def __init__(self):
+    def __init__(self, uris=None, filters_uris=None):
         """
             Create database tables or manage update if needed
+            @param uris as [str], default hosts lists if None
+            @param filters_uris as [str], default filters lists if None
         """
+        self.__uris = self.__URIS if uris is None else uris
+        self.__filters_uris = self.__FILTERS_URIS if filters_uris is None\
+            else filters_uris
         self.__cancellable = Gio.Cancellable.new()
+        self.__hosts = None
+        self.__stamp = None
+        self.__filters = None
+        self.__filters_stamp = None
+        self.__exceptions = None
+        self.__exceptions_stamp = None
+        self.__css = None
+        self.__content_filtered = None
+        self.__verdicts = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
         f = Gio.File.new_for_path(self.DB_PATH)
-        # Lazy loading if not empty
-        self.__sleep = 0.5
         if not f.query_exists():
             try:
-                self.__sleep = 0.1
                 d = Gio.File.new_for_path(self.__LOCAL_PATH)
                 if not d.query_exists():
                     d.make_directory_with_parents()
                 # Create db schema
                 with SqlCursor(self) as sql:
+                    # Readers are never blocked by update transaction
+                    sql.execute("PRAGMA journal_mode=WAL")
                     sql.execute(self.__create_adblock)
+                    sql.execute(self.__create_adblock_idx)
+                    sql.execute(self.__create_sources)
+                    sql.execute(self.__create_generation)
+                    sql.execute(self.__create_exceptions)
                     sql.commit()
             except Exception as e:
                 print("DatabaseAdblock::__init__(): %s" % e)
 
-    def update(self):
+    def update(self, callback=None, force=False):
         """
-            Update database
+            Update database and compiled index
+            @param callback as function, run in main loop if lists changed
+            @param force as bool, update even if network is unavailable,
+                   for lists served locally
         """
-        if Gio.NetworkMonitor.get_default().get_network_available():
-            self.__mtime = int(time())
-            self.__thread = Thread(target=self.__update)
-            self.__thread.daemon = True
-            self.__thread.start()
+        self.__mtime = int(time())
+        self.__thread = Thread(target=self.__update, args=(callback, force))
+        self.__thread.daemon = True
+        self.__thread.start()
 
     def stop(self):
         """
@@ -85,23 +149,233 @@ class DatabaseAdblock:
         self.__cancellable.cancel()
         self.__cancellable.reset()
 
-    def is_blocked(self, uri):
+    def reload(self):
+        """
+            Swap in compiled index and filters if they changed on disk
+            since last load, refresh content filter state
+            Only costs stat() calls, so do not call it per request
         """
-            Return True if uri is blocked
+        try:
+            self.__content_filtered = GLib.file_test(self.CONTENT_FILTER_PATH,
+                                                     GLib.FileTest.EXISTS)
+            stamp = self.__get_stamp(self.EXCEPTIONS_PATH)
+            if self.__exceptions is not None and\
+                    stamp != self.__exceptions_stamp:
+                self.__load_exceptions()
+            # Not loaded yet, first lookup will get last index
+            if self.__hosts is None:
+                return
+            stamp = self.__get_stamp(self.INDEX_PATH)
+            if stamp is not None and stamp != self.__stamp:
+                # Keep current list until new one is ready
+                self.__hosts = AdblockIndex(self.INDEX_PATH)
+                self.__stamp = stamp
+                self.__verdicts.clear()
+            stamp = self.__get_stamp(self.FILTERS_INDEX_PATH)
+            if stamp is not None and stamp != self.__filters_stamp:
+                self.__load_filters()
+        except Exception as e:
+            print("DatabaseAdblock::reload():", e)
+
+    def is_blocked(self, uri, page_uri=None):
+        """
+            Return True if uri host or one of its parent domains is blocked
+            or if uri is blocked by a filter
             @param uri as str
+            @param page_uri as str/None
             @return bool
         """
+        if self.__hosts is None:
+            self.__load()
         try:
-            parse = urlparse(uri)
-            with SqlCursor(self) as sql:
-                result = sql.execute("SELECT mtime FROM adblock\
-                                      WHERE dns=?", (parse.netloc,))
-                v = result.fetchone()
-                return v is not None
+            if self.__is_uri_host_blocked(uri):
+                return True
+            return self.__filters is not None and\
+                self.__filters.is_blocked(uri, page_uri)
         except Exception as e:
             print("DatabaseAdblock::is_blocked():", e)
             return False
 
+    def is_content_filtered(self):
+        """
+            True if a WebKit content filter blocks ads in views, state is
+            refreshed by reload()
+            @return bool
+        """
+        if self.__content_filtered is None:
+            self.__content_filtered = GLib.file_test(self.CONTENT_FILTER_PATH,
+                                                     GLib.FileTest.EXISTS)
+        return self.__content_filtered
+
+    def set_content_filtered(self, filtered):
+        """
+            Tell web processes if a WebKit content filter blocks ads in
+            views, they do not filter requests then
+            @param filtered as bool
+        """
+        try:
+            f = Gio.File.new_for_path(self.CONTENT_FILTER_PATH)
+            if filtered:
+                f.replace_contents(b"", None, False,
+                                   Gio.FileCreateFlags.REPLACE_DESTINATION,
+                                   None)
+            elif f.query_exists():
+                f.delete(None)
+            self.__content_filtered = filtered
+        except Exception as e:
+            print("DatabaseAdblock::set_content_filtered():", e)
+
+    def is_exception(self, page_uri):
+        """
+            True if user allowed ads on page site or one of its parents
+            Check it once per page, not per request
+            @param page_uri as str
+            @return bool
+        """
+        if self.__exceptions is None:
+            self.__load_exceptions()
+        if not self.__exceptions or not page_uri:
+            return False
+        host = urlparse(page_uri).hostname
+        if host is None:
+            return False
+        for suffix in host_suffixes(host.rstrip(".")):
+            if suffix in self.__exceptions:
+                return True
+        return False
+
+    def add_exception(self, page_uri):
+        """
+            Allow ads on page site
+            @param page_uri as str
+        """
+        site = self.__get_site(page_uri)
+        if site is None:
+            return
+        try:
+            with SqlCursor(self) as sql:
+                sql.execute(self.__create_exceptions)
+                sql.execute("INSERT OR IGNORE INTO exceptions (site)\
+                             VALUES (?)", (site,))
+                sql.commit()
+                self.__save_exceptions(sql)
+        except Exception as e:
+            print("DatabaseAdblock::add_exception():", e)
+
+    def remove_exception(self, page_uri):
+        """
+            Block ads again on page site and its parents
+            @param page_uri as str
+        """
+        host = urlparse(page_uri).hostname
+        if host is None:
+            return
+        try:
+            with SqlCursor(self) as sql:
+                sql.execute(self.__create_exceptions)
+                sql.executemany("DELETE FROM exceptions WHERE site=?",
+                                ((suffix,) for suffix in
+                                 host_suffixes(host.rstrip("."))))
+                sql.commit()
+                self.__save_exceptions(sql)
+        except Exception as e:
+            print("DatabaseAdblock::remove_exception():", e)
+
+    def get_exceptions(self):
+        """
+            Get sites user allowed ads on
+            @return [str]
+        """
+        try:
+            with SqlCursor(self) as sql:
+                sql.execute(self.__create_exceptions)
+                result = sql.execute("SELECT site FROM exceptions\
+                                      ORDER BY site")
+                return [row[0] for row in result]
+        except Exception as e:
+            print("DatabaseAdblock::get_exceptions():", e)
+        return []
+
+    def get_css(self, host):
+        """
+            Get element hiding stylesheets for host
+            @param host as str
+            @return (generic as str, domain as str) or None if unavailable
+        """
+        try:
+            if self.__css is None:
+                self.__css = AdblockCss(self.CSS_PATH)
+            return (self.__css.get_generic(), self.__css.get_domain(host))
+        except Exception as e:
+            print("DatabaseAdblock::get_css():", e)
+            # Compiled filters may be replaced, load them again next time
+            self.__css = None
+        return None
+
+    def get_content_rules(self):
+        """
+            Get blocklist as WebKit content blocker JSON rulesets, split to
+            stay under WebKit rules limit
+            Only hosts and ||domain^ filters are converted
+            @return [str]
+        """
+        domains = []
+        with SqlCursor(self) as sql:
+            result = sql.execute("SELECT dns FROM adblock")
+            domains += [(row[0], False) for row in result]
+        if GLib.file_test(self.FILTERS_PATH, GLib.FileTest.EXISTS):
+            domain = re.compile(r"^\|\|([a-z0-9._-]+)\^(\$third-party)?$")
+            with open(self.FILTERS_PATH, "r", encoding="utf-8") as f:
+                for line in f:
+                    match = domain.match(line.strip().lower())
+                    if match is not None:
+                        domains.append((match.group(1),
+                                        match.group(2) is not None))
+        rules = []
+        for (dns, third_party) in domains:
+            trigger = {"url-filter": "^[^:]+://+([^:/]+\\.)?%s[:/]" %
+                       dns.replace(".", "\\.")}
+            if third_party:
+                trigger["load-type"] = ["third-party"]
+            rules.append({"trigger": trigger, "action": {"type": "block"}})
+        exception = None
+        sites = ["*%s" % site for site in self.get_exceptions()]
+        if sites:
+            exception = {"trigger": {"url-filter": ".*",
+                                     "if-domain": sites},
+                         "action": {"type": "ignore-previous-rules"}}
+        size = self.__CONTENT_RULES_SIZE - (exception is not None)
+        rulesets = []
+        for i in range(0, len(rules), size):
+            ruleset = rules[i:i + size]
+            # Must come last, only previous rules of ruleset are ignored
+            if exception is not None:
+                ruleset.append(exception)
+            rulesets.append(json.dumps(ruleset))
+        return rulesets
+
+    def get_cache_stats(self):
+        """
+            Get verdict cache statistics
+            @return (hits as int, misses as int, size as int)
+        """
+        return (self.__hits, self.__misses, len(self.__verdicts))
+
+    def get_generation(self):
+        """
+            Get current blocklist generation, 0 if never updated
+            @return int
+        """
+        try:
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT value FROM generation")
+                v = result.fetchone()
+                if v is not None:
+                    return v[0]
+        except Exception as e:
+            print("DatabaseAdblock::get_generation():", e)
+        return 0
+
     def get_cursor(self):
         """
             Return a new sqlite cursor
@@ -115,52 +389,402 @@ class DatabaseAdblock:
 #######################
 # PRIVATE             #
 #######################
-    def __update(self):
+    def __load(self):
+        """
+            Load blocked hosts in memory, lookups never hit db after this
+            Use compiled index if available, shared with other processes
+        """
+        self.__load_filters()
+        try:
+            self.__stamp = self.__get_stamp(self.INDEX_PATH)
+            self.__hosts = AdblockIndex(self.INDEX_PATH)
+            return
+        except Exception as e:
+            print("DatabaseAdblock::__load():", e)
+        try:
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT dns FROM adblock")
+                self.__hosts = frozenset(row[0] for row in result)
+        except Exception as e:
+            print("DatabaseAdblock::__load():", e)
+            self.__hosts = frozenset()
+
+    def __load_filters(self):
+        """
+            Map compiled filters, keep current ones on error
+            Filters are parsed on first use, not on load
+        """
+        try:
+            stamp = self.__get_stamp(self.FILTERS_INDEX_PATH)
+            if stamp is not None:
+                self.__filters = AdblockFilters(self.FILTERS_INDEX_PATH)
+                self.__filters_stamp = stamp
+        except Exception as e:
+            print("DatabaseAdblock::__load_filters():", e)
+
+    def __load_exceptions(self):
+        """
+            Load exceptions exported by __save_exceptions()
+        """
+        try:
+            stamp = self.__get_stamp(self.EXCEPTIONS_PATH)
+            exceptions = frozenset()
+            if stamp is not None:
+                with open(self.EXCEPTIONS_PATH, "r", encoding="utf-8") as f:
+                    exceptions = frozenset(line.strip() for line in f
+                                           if line.strip())
+            self.__exceptions = exceptions
+            self.__exceptions_stamp = stamp
+        except Exception as e:
+            print("DatabaseAdblock::__load_exceptions():", e)
+            if self.__exceptions is None:
+                self.__exceptions = frozenset()
+
+    def __save_exceptions(self, sql):
+        """
+            Export exceptions for web processes, they only stat() this
+            file instead of querying db
+            @param sql as sqlite3.Connection
+        """
+        result = sql.execute("SELECT site FROM exceptions")
+        content = "\n".join(row[0] for row in result)
+        f = Gio.File.new_for_path(self.EXCEPTIONS_PATH)
+        f.replace_contents(content.encode("utf-8"), None, False,
+                           Gio.FileCreateFlags.REPLACE_DESTINATION, None)
+        self.__load_exceptions()
+
+    def __get_site(self, page_uri):
+        """
+            Get site for page uri: its host without www
+            @param page_uri as str
+            @return str/None
+        """
+        host = urlparse(page_uri).hostname
+        if host is None:
+            return None
+        host = host.rstrip(".")
+        if host.startswith("www.") and host.count(".") > 1:
+            host = host[4:]
+        return host
+
+    def __is_uri_host_blocked(self, uri):
+        """
+            True if uri host is blocked, verdicts are cached per host
+            @param uri as str
+            @return bool
+        """
+        # Fast path for scheme://netloc/..., no need to parse uri
+        parts = uri.split("/", 3)
+        if len(parts) < 3 or parts[1]:
+            return self.__is_host_blocked(urlparse(uri).hostname)
+        netloc = parts[2]
+        verdict = self.__verdicts.get(netloc)
+        if verdict is not None:
+            self.__hits += 1
+            self.__verdicts.move_to_end(netloc)
+            return verdict
+        self.__misses += 1
+        verdict = self.__is_host_blocked(urlparse(uri).hostname)
+        self.__verdicts[netloc] = verdict
+        if len(self.__verdicts) > self.__VERDICTS_SIZE:
+            self.__verdicts.popitem(last=False)
+        return verdict
+
+    def __is_host_blocked(self, host):
+        """
+            True if host or one of its parent domains is blocked
+            @param host as str, lowercased, without userinfo and port
+            @return bool
+        """
+        if host is None:
+            return False
+        for suffix in host_suffixes(host.rstrip(".")):
+            if suffix in self.__hosts:
+                return True
+        return False
+
+    def __get_stamp(self, path):
+        """
+            Get file stamp, changes each time file is replaced
+            @param path as str
+            @return (int, int) or None
+        """
+        try:
+            st = stat(path)
+            return (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def __compile(self):
+        """
+            Compile db to index
+        """
+        try:
+            generation = self.get_generation()
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT dns FROM adblock")
+                AdblockIndex.write(self.INDEX_PATH,
+                                   (row[0] for row in result),
+                                   generation)
+        except Exception as e:
+            print("DatabaseAdblock::__compile():", e)
+
+    def __compile_filters(self):
+        """
+            Compile saved network filters to index
+        """
+        try:
+            with open(self.FILTERS_PATH, "r", encoding="utf-8",
+                      errors="ignore") as f:
+                (count, scanned) = AdblockFilters.write(
+                                                self.FILTERS_INDEX_PATH, f)
+            debug("Adblock: %s filters, %s checked on every request" %
+                  (count, scanned))
+        except Exception as e:
+            print("DatabaseAdblock::__compile_filters():", e)
+
+    def __get_cache_path(self, uri):
+        """
+            Get raw cache path for uri
+            @param uri as str
+            @return str
+        """
+        checksum = GLib.compute_checksum_for_string(GLib.ChecksumType.MD5,
+                                                    uri, -1)
+        return "%s/%s.txt" % (self.__CACHE_PATH, checksum)
+
+    def __download(self, session, uri, results, index):
+        """
+            Download uri, revalidate raw cache if available
+            Set results[index] to (content, changed, etag, modified, checksum)
+            or None if no content is available
+            A list has changed if its checksum is not the one saved with
+            last ingest: raw cache may be newer than db if ingest failed
+            @param session as Soup.Session
+            @param uri as str
+            @param results as list
+            @param index as int
+        """
+        f = Gio.File.new_for_path(self.__get_cache_path(uri))
+        cached = None
+        (etag, modified, checksum) = (None, None, None)
+        try:
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT etag, modified, checksum\
+                                      FROM sources WHERE uri=?", (uri,))
+                v = result.fetchone()
+            if v is not None:
+                (etag, modified, checksum) = v
+            if f.query_exists():
+                cached = f.load_contents(self.__cancellable)[1]
+            message = Soup.Message.new("GET", uri)
+            if cached is not None:
+                if etag:
+                    message.request_headers.append("If-None-Match", etag)
+                if modified:
+                    message.request_headers.append("If-Modified-Since",
+                                                   modified)
+            stream = session.send(message, self.__cancellable)
+            status = message.status_code
+            if status == Soup.Status.NOT_MODIFIED and cached is not None:
+                stream.close(None)
+                data = cached
+            elif status != Soup.Status.OK:
+                raise IOError("HTTP status %s" % status)
+            else:
+                output = Gio.MemoryOutputStream.new_resizable()
+                output.splice(stream,
+                              Gio.OutputStreamSpliceFlags.CLOSE_SOURCE |
+                              Gio.OutputStreamSpliceFlags.CLOSE_TARGET,
+                              self.__cancellable)
+                data = output.steal_as_bytes().get_data()
+                if data != cached:
+                    f.replace_contents(
+                        data, None, False,
+                        Gio.FileCreateFlags.REPLACE_DESTINATION,
+                        self.__cancellable)
+                headers = message.response_headers
+                etag = headers.get_one("ETag")
+                modified = headers.get_one("Last-Modified")
+            new_checksum = self.__get_checksum(data)
+            results[index] = (data.decode('utf-8'), new_checksum != checksum,
+                              etag, modified, new_checksum)
+        except Exception as e:
+            print("DatabaseAdblock::__download():", uri, e)
+            # Keep previous list if server is unavailable
+            if cached is not None:
+                new_checksum = self.__get_checksum(cached)
+                results[index] = (cached.decode('utf-8'),
+                                  new_checksum != checksum,
+                                  None, None, new_checksum)
+
+    def __get_checksum(self, data):
+        """
+            Get checksum for raw list
+            @param data as bytes
+            @return str
+        """
+        return GLib.compute_checksum_for_data(GLib.ChecksumType.MD5, data)
+
+    def __save_filters(self, results):
+        """
+            Save network filters and compile element hiding filters from
+            downloaded lists
+            @param results as [(str, bool, str, str, str)], see __download()
+            @return True if filters changed
+        """
+        if None in results:
+            return False
+        if not [result for result in results if result[1]] and\
+                GLib.file_test(self.FILTERS_PATH, GLib.FileTest.EXISTS) and\
+                GLib.file_test(self.CSS_PATH, GLib.FileTest.EXISTS):
+            return False
+        try:
+            lines = list(chain.from_iterable(result[0].splitlines()
+                                             for result in results))
+            content = "\n".join(line for line in lines
+                                if is_network_filter(line))
+            f = Gio.File.new_for_path(self.FILTERS_PATH)
+            f.replace_contents(content.encode("utf-8"), None, False,
+                               Gio.FileCreateFlags.REPLACE_DESTINATION,
+                               self.__cancellable)
+            self.__compile_filters()
+            AdblockCss.write(self.CSS_PATH, lines)
+            self.__css = None
+            with SqlCursor(self) as sql:
+                self.__save_sources(sql, self.__filters_uris, results)
+                sql.commit()
+            return True
+        except Exception as e:
+            print("DatabaseAdblock::__save_filters():", e)
+        return False
+
+    def __save_sources(self, sql, uris, results):
+        """
+            Save HTTP validators and checksums for changed lists
+            Must be committed with ingested lists, see __download()
+            @param sql as sqlite3.Connection
+            @param uris as [str]
+            @param results as [(str, bool, str, str, str)], see __download()
+        """
+        sql.executemany("INSERT OR REPLACE INTO sources\
+                         (uri, etag, modified, checksum)\
+                         VALUES (?, ?, ?, ?)",
+                        [(uri, result[2], result[3], result[4])
+                         for (uri, result) in zip(uris, results)
+                         if result[1]])
+
+    def __parse(self, content):
+        """
+            Parse hosts file content
+            @param content as str
+            @return iterator of str
+        """
+        for line in content.splitlines():
+            if self.__cancellable.is_cancelled():
+                raise IOError("Cancelled")
+            fields = line.split('#', 1)[0].split()
+            # Hosts file format: address host [host...]
+            # Skip entries like localhost or broadcasthost
+            for dns in fields[1:]:
+                if '.' in dns:
+                    yield dns.lower()
+
+    def __update(self, callback, force):
         """
             Update database
+            @param callback as function/None
+            @param force as bool
         """
-        result = ""
-        try:
-            for uri in self.__URIS:
-                session = Soup.Session.new()
-                request = session.request(uri)
-                stream = request.send(self.__cancellable)
-                bytes = bytearray(0)
-                buf = stream.read_bytes(1024, self.__cancellable).get_data()
-                while buf:
-                    bytes += buf
-                    buf = stream.read_bytes(
-                                           1024, self.__cancellable).get_data()
-                result = bytes.decode('utf-8')
-                for line in result.split('\n'):
-                    if self.__cancellable.is_cancelled():
-                        raise IOError("Cancelled")
-                    sleep(self.__sleep)
-                    if line.startswith('#'):
-                        continue
-                    array = line.replace(
-                                 ' ', '\t', 1).replace('\t', '@', 1).split('@')
-                    if len(array) <= 1:
-                        continue
-                    dns = array[1].replace(
-                                       ' ', '').replace('\r', '').split('#')[0]
-                    # Update entry if exists, create else
-                    with SqlCursor(self) as sql:
-                        result = sql.execute("SELECT mtime FROM adblock\
-                                              WHERE dns=?", (dns,))
-                        v = result.fetchone()
-                        if v is not None:
-                            sql.execute("UPDATE adblock set mtime=?\
-                                         WHERE dns=?", (self.__mtime, dns))
-                        else:
-                            sql.execute("INSERT INTO adblock\
-                                              (dns, mtime)\
-                                              VALUES (?, ?)",
-                                        (dns, self.__mtime))
-                        sql.commit()
-            # Delete removed entries
+        if not GLib.file_test(self.INDEX_PATH, GLib.FileTest.EXISTS):
+            self.__compile()
+        # Filters saved by older versions were never compiled
+        if GLib.file_test(self.FILTERS_PATH, GLib.FileTest.EXISTS) and\
+                not GLib.file_test(self.FILTERS_INDEX_PATH,
+                                   GLib.FileTest.EXISTS):
+            self.__compile_filters()
+        if not force and\
+                not Gio.NetworkMonitor.get_default().get_network_available():
+            return
+        try:
+            d = Gio.File.new_for_path(self.__CACHE_PATH)
+            if not d.query_exists():
+                d.make_directory_with_parents()
+            with SqlCursor(self) as sql:
+                sql.execute(self.__create_sources)
+                sql.execute(self.__create_generation)
+                # Tables from older versions have no checksum, lists are
+                # ingested again
+                result = sql.execute("PRAGMA table_info(sources)")
+                if "checksum" not in [row[1] for row in result]:
+                    sql.execute("ALTER TABLE sources ADD COLUMN\
+                                 checksum TEXT")
+                    sql.commit()
+            # Fetch all lists concurrently over one session
+            uris = self.__uris + self.__filters_uris
+            session = Soup.Session.new()
+            results = [None] * len(uris)
+            threads = []
+            for i in range(0, len(uris)):
+                thread = Thread(target=self.__download,
+                                args=(session, uris[i], results, i))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            filters_results = results[len(self.__uris):]
+            results = results[:len(self.__uris)]
+            filters_changed = self.__save_filters(filters_results)
+            # Hosts are not tracked per list: if a list is missing, its
+            # hosts can not be told apart, so nothing is removed
+            missing = None in results
+            uris = [uri for (uri, result) in zip(self.__uris, results)
+                    if result is not None]
+            results = [result for result in results if result is not None]
+            # Nothing changed, nothing to write
+            if not [result for result in results if result[1]]:
+                if filters_changed and callback is not None:
+                    GLib.idle_add(callback)
+                return
+            new = set(chain.from_iterable(self.__parse(result[0])
+                                          for result in results))
+            # Only apply differences, readers keep seeing previous list
+            # until commit
             with SqlCursor(self) as sql:
-                sql.execute("DELETE FROM adblock\
-                             WHERE mtime!=?", (self.__mtime,))
+                try:
+                    sql.execute("PRAGMA journal_mode=WAL")
+                    sql.execute("BEGIN IMMEDIATE")
+                    # Databases from older versions may contain duplicates
+                    sql.execute("DELETE FROM adblock WHERE rowid NOT IN\
+                                 (SELECT MIN(rowid) FROM adblock\
+                                  GROUP BY dns)")
+                    sql.execute(self.__create_adblock_idx)
+                    result = sql.execute("SELECT dns FROM adblock")
+                    old = set(row[0] for row in result)
+                    removed = set() if missing else old - new
+                    added = new - old
+                    sql.executemany("DELETE FROM adblock WHERE dns=?",
+                                    ((dns,) for dns in removed))
+                    sql.executemany("INSERT INTO adblock\
+                                     (dns, mtime) VALUES (?, ?)",
+                                    ((dns, self.__mtime) for dns in added))
+                    if removed or added:
+                        sql.execute("INSERT OR REPLACE INTO generation\
+                                     (id, value) VALUES (1, ?)",
+                                    (self.get_generation() + 1,))
+                    # Lists stay changed until removals can be applied
+                    if not missing:
+                        self.__save_sources(sql, uris, results)
+                    sql.commit()
+                except:
+                    sql.rollback()
+                    raise
+            if removed or added:
+                self.__compile()
+            elif not filters_changed:
+                return
+            if callback is not None:
+                GLib.idle_add(callback)
         except Exception as e:
             print("DatabaseAdlbock:__update():", e)
@@ -13,12 +13,13 @@
 from gi.repository import GLib, Gio
 
 import sqlite3
+import locale
 
-from eolie.utils import noaccents
-from eolie.localized import LocalizedCollation
+from eolie.utils import fold, get_canonical_uri
 from eolie.sqlcursor import SqlCursor
+from eolie.sqlschema import FtsIndex, upgrade_schema
 from eolie.database_history import DatabaseHistory
-from eolie.define import El
+from eolie.define import El, Transition
 
 
 class DatabaseBookmarks:
@@ -30,6 +31,8 @@ class DatabaseBookmarks:
     else:
         __LOCAL_PATH = GLib.getenv("XDG_DATA_HOME") + "/eolie"
     DB_PATH = "%s/bookmarks.db" % __LOCAL_PATH
+    # Schema version, stored in PRAGMA user_version
+    __VERSION = 3
 
     # SQLite documentation:
     # In SQLite, a column with type INTEGER PRIMARY KEY
@@ -39,19 +42,35 @@ class DatabaseBookmarks:
     __create_bookmarks = '''CREATE TABLE bookmarks (
                                                id INTEGER PRIMARY KEY,
                                                title TEXT NOT NULL,
-                                               uri TEXT NOT NULL
+                                               uri TEXT NOT NULL,
+                                               title_fold TEXT NOT NULL
+                                                   DEFAULT '',
+                                               uri_fold TEXT NOT NULL
+                                                   DEFAULT '',
+                                               canonical TEXT NOT NULL
+                                                   DEFAULT ''
                                                )'''
+    # Joins history on canonical uri, see utils.get_canonical_uri()
+    __create_bookmarks_canonical_idx = '''CREATE INDEX IF NOT EXISTS
+                        idx_bookmarks_canonical ON bookmarks(canonical)'''
+    # sortkey is locale.strxfrm(title)
     __create_tags = '''CREATE TABLE tags (id INTEGER PRIMARY KEY,
-                                          title TEXT NOT NULL)'''
+                                          title TEXT NOT NULL,
+                                          sortkey TEXT NOT NULL DEFAULT '')'''
     __create_bookmarks_tags = '''CREATE TABLE bookmarks_tags (
                                                     id INTEGER PRIMARY KEY,
                                                     bookmark_id INT NOT NULL,
                                                     tag_id INT NOT NULL)'''
+    # Locale used to compute tags sort keys
+    __create_collation = '''CREATE TABLE collation (
+                                               locale TEXT NOT NULL)'''
 
     def __init__(self):
         """
             Create database tables or manage update if needed
         """
+        self.__fts_index = FtsIndex("bookmarks")
+        self.__fts = False
         f = Gio.File.new_for_path(self.DB_PATH)
         if not f.query_exists():
             try:
@@ -61,11 +80,25 @@ class DatabaseBookmarks:
                 # Create db schema
                 with SqlCursor(self) as sql:
                     sql.execute(self.__create_bookmarks)
+                    sql.execute(self.__create_bookmarks_canonical_idx)
                     sql.execute(self.__create_tags)
                     sql.execute(self.__create_bookmarks_tags)
+                    sql.execute(self.__create_collation)
+                    sql.execute("INSERT INTO collation (locale) VALUES (?)",
+                                (locale.setlocale(locale.LC_COLLATE),))
+                    self.__fts_index.create(sql)
+                    sql.execute("PRAGMA user_version=%s" % self.__VERSION)
                     sql.commit()
             except Exception as e:
                 print("DatabaseBookmarks::__init__(): %s" % e)
+        else:
+            self.__upgrade()
+        try:
+            with SqlCursor(self) as sql:
+                self.__fts = self.__fts_index.exists(sql)
+        except Exception as e:
+            print("DatabaseBookmarks::__init__(): %s" % e)
+        self.__update_sortkeys()
 
     def add(self, title, uri, tags):
         """
@@ -78,9 +111,11 @@ class DatabaseBookmarks:
             return
         with SqlCursor(self) as sql:
             result = sql.execute("INSERT INTO bookmarks\
-                                  (title, uri)\
-                                  VALUES (?, ?)",
-                                 (title, uri))
+                                  (title, uri, title_fold, uri_fold,\
+                                   canonical)\
+                                  VALUES (?, ?, ?, ?, ?)",
+                                 (title, uri, fold(title), fold(uri),
+                                  get_canonical_uri(uri)))
             bookmarks_id = result.lastrowid
             for tag in tags:
                 if not tag:
@@ -88,15 +123,15 @@ class DatabaseBookmarks:
                 tag_id = self.get_tag_id(tag)
                 if tag_id is None:
                     result = sql.execute("INSERT INTO tags\
-                                          (title) VALUES (?)",
-                                         (tag,))
+                                          (title, sortkey) VALUES (?, ?)",
+                                         (tag, locale.strxfrm(tag)))
                     tag_id = result.lastrowid
                 sql.execute("INSERT INTO bookmarks_tags\
                              (bookmark_id, tag_id) VALUES (?, ?)",
                             (bookmarks_id, tag_id))
             sql.commit()
             # We need this as current db is attached to history
-            El().history.add(title, uri, 0)
+            El().history.add(title, uri, 0, Transition.BOOKMARK)
 
     def get_id(self, uri):
         """
@@ -134,7 +169,7 @@ class DatabaseBookmarks:
         with SqlCursor(self) as sql:
             result = sql.execute("SELECT rowid, title\
                                   FROM tags\
-                                  ORDER BY title COLLATE LOCALIZED")
+                                  ORDER BY sortkey")
             return list(result)
 
     def get_bookmarks(self, tag_id):
@@ -151,8 +186,8 @@ class DatabaseBookmarks:
                             FROM bookmarks, bookmarks_tags, history.history\
                             WHERE bookmarks.rowid=bookmarks_tags.bookmark_id\
                             AND bookmarks_tags.tag_id=?\
-                            AND history.uri=bookmarks.uri\
-                            ORDER BY history.popularity DESC",
+                            AND history.canonical=bookmarks.canonical\
+                            ORDER BY history.score DESC",
                                  (tag_id,))
             return list(result)
 
@@ -166,9 +201,9 @@ class DatabaseBookmarks:
                                    bookmarks.title,\
                                    bookmarks.uri\
                             FROM bookmarks, history.history\
-                            WHERE history.uri=bookmarks.uri\
+                            WHERE history.canonical=bookmarks.canonical\
                             AND history.popularity!=0\
-                            ORDER BY history.popularity DESC")
+                            ORDER BY history.score DESC")
             return list(result)
 
     def get_recents(self):
@@ -181,7 +216,7 @@ class DatabaseBookmarks:
                                    bookmarks.title,\
                                    bookmarks.uri\
                             FROM bookmarks, history.history\
-                            WHERE history.uri=bookmarks.uri\
+                            WHERE history.canonical=bookmarks.canonical\
                             AND history.mtime != 0\
                             ORDER BY history.mtime DESC")
             return list(result)
@@ -225,13 +260,28 @@ class DatabaseBookmarks:
             Search string in db (uri and title)
             @param search as str
         """
+        search = fold(search)
+        match = self.__fts_index.get_match(search)
         with SqlCursor(self) as sql:
+            if self.__fts and match is not None:
+                result = sql.execute("SELECT bookmarks.title, bookmarks.uri\
+                                      FROM bookmarks_fts, bookmarks\
+                                      LEFT JOIN history.history\
+                                      ON history.canonical=\
+                                         bookmarks.canonical\
+                                      WHERE bookmarks_fts MATCH ?\
+                                      AND bookmarks.id=bookmarks_fts.rowid\
+                                      ORDER BY history.score DESC",
+                                     (match,))
+                return list(result)
             filter = '%' + search + '%'
-            result = sql.execute("SELECT title, uri\
+            result = sql.execute("SELECT bookmarks.title, bookmarks.uri\
                                   FROM bookmarks\
-                                  WHERE title LIKE ?\
-                                   OR uri LIKE ?\
-                                  ORDER BY popularity DESC, mtime DESC",
+                                  LEFT JOIN history.history\
+                                  ON history.canonical=bookmarks.canonical\
+                                  WHERE bookmarks.title_fold LIKE ?\
+                                   OR bookmarks.uri_fold LIKE ?\
+                                  ORDER BY history.score DESC",
                                  (filter, filter))
             return list(result)
 
@@ -241,10 +291,8 @@ class DatabaseBookmarks:
         """
         try:
             c = sqlite3.connect(self.DB_PATH, 600.0)
-            c.create_collation('LOCALIZED', LocalizedCollation())
             c.execute("ATTACH DATABASE '%s' AS history" %
                       DatabaseHistory.DB_PATH)
-            c.create_function("noaccents", 1, noaccents)
             return c
         except:
             exit(-1)
@@ -262,3 +310,76 @@ class DatabaseBookmarks:
 #######################
 # PRIVATE             #
 #######################
+    def __upgrade(self):
+        """
+            Upgrade database schema to current version
+        """
+        # Full text index of upgrade 1 now needs upgrade 2 columns
+        upgrades = {1: None,
+                    2: self.__upgrade_2,
+                    3: self.__upgrade_3}
+        try:
+            with SqlCursor(self) as sql:
+                upgrade_schema(sql, upgrades, self.__VERSION)
+        except Exception as e:
+            print("DatabaseBookmarks::__upgrade():", e)
+
+    def __upgrade_2(self, sql):
+        """
+            Add folded title and uri, index them for full text search
+            Add tags sort keys
+            @param sql as sqlite3.Connection
+        """
+        self.__fts_index.drop(sql)
+        sql.execute("ALTER TABLE main.bookmarks ADD COLUMN\
+                     title_fold TEXT NOT NULL DEFAULT ''")
+        sql.execute("ALTER TABLE main.bookmarks ADD COLUMN\
+                     uri_fold TEXT NOT NULL DEFAULT ''")
+        result = sql.execute("SELECT rowid, title, uri FROM bookmarks")
+        sql.executemany("UPDATE bookmarks SET title_fold=?, uri_fold=?\
+                         WHERE rowid=?",
+                        [(fold(title), fold(uri), rowid)
+                         for (rowid, title, uri) in list(result)])
+        if self.__fts_index.create(sql):
+            self.__fts_index.rebuild(sql)
+        sql.execute("ALTER TABLE main.tags ADD COLUMN\
+                     sortkey TEXT NOT NULL DEFAULT ''")
+        # Empty locale, sort keys are computed by __update_sortkeys()
+        sql.execute(self.__create_collation)
+        sql.execute("INSERT INTO collation (locale) VALUES ('')")
+
+    def __upgrade_3(self, sql):
+        """
+            Add canonical uri
+            @param sql as sqlite3.Connection
+        """
+        sql.execute("ALTER TABLE main.bookmarks ADD COLUMN\
+                     canonical TEXT NOT NULL DEFAULT ''")
+        result = sql.execute("SELECT rowid, uri FROM bookmarks")
+        sql.executemany("UPDATE bookmarks SET canonical=? WHERE rowid=?",
+                        [(get_canonical_uri(uri), rowid)
+                         for (rowid, uri) in list(result)])
+        sql.execute("CREATE INDEX IF NOT EXISTS main.idx_bookmarks_canonical\
+                     ON bookmarks(canonical)")
+
+    def __update_sortkeys(self):
+        """
+            Compute tags sort keys again if locale changed
+        """
+        try:
+            current = locale.setlocale(locale.LC_COLLATE)
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT locale FROM collation")
+                v = result.fetchone()
+                if v is not None and v[0] == current:
+                    return
+                result = sql.execute("SELECT rowid, title FROM tags")
+                sql.executemany("UPDATE tags SET sortkey=? WHERE rowid=?",
+                                [(locale.strxfrm(title), rowid)
+                                 for (rowid, title) in list(result)])
+                sql.execute("DELETE FROM collation")
+                sql.execute("INSERT INTO collation (locale) VALUES (?)",
+                            (current,))
+                sql.commit()
+        except Exception as e:
+            print("DatabaseBookmarks::__update_sortkeys():", e)
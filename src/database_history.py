@@ -13,11 +13,16 @@
 from gi.repository import GLib, Gio
 
 import sqlite3
+from math import log
 from time import time
+from threading import Thread, Lock
+from queue import Queue
 
-from eolie.utils import noaccents
-from eolie.localized import LocalizedCollation
+from eolie.utils import fold, logaddexp, get_canonical_uri
 from eolie.sqlcursor import SqlCursor
+from eolie.sqlschema import FtsIndex, upgrade_schema
+from eolie.define import El, Transition
+from eolie.prefix_index import PrefixIndex, get_prefix_keys
 
 
 class DatabaseHistory:
@@ -29,6 +34,23 @@ class DatabaseHistory:
     else:
         __LOCAL_PATH = GLib.getenv("XDG_DATA_HOME") + "/eolie"
     DB_PATH = "%s/history.db" % __LOCAL_PATH
+    # Schema version, stored in PRAGMA user_version
+    __VERSION = 6
+    # Frecency: a visit weighs half as much after this delay in seconds
+    __HALF_LIFE = 30 * 24 * 3600
+    # Queued visits are written after this delay in ms or at this count
+    __FLUSH_DELAY = 300
+    __FLUSH_SIZE = 50
+    # Maximum search results
+    __SEARCH_LIMIT = 50
+    # Visits are kept this many days, they are already counted in history
+    __VISITS_RETENTION = 90
+    # Entries not visited for this many days are removed if not bookmarked
+    __HISTORY_RETENTION = 365
+    # Prune old entries when browser is idle since this delay in seconds
+    __PRUNE_DELAY = 300
+    # Entries given a canonical uri per transaction by migration
+    __CANONICAL_BATCH = 500
 
     # SQLite documentation:
     # In SQLite, a column with type INTEGER PRIMARY KEY
@@ -40,13 +62,66 @@ class DatabaseHistory:
                                                title TEXT NOT NULL,
                                                uri TEXT NOT NULL,
                                                mtime INT NOT NULL,
-                                               popularity INT NOT NULL
+                                               popularity INT NOT NULL,
+                                               score REAL NOT NULL DEFAULT 0,
+                                               title_fold TEXT NOT NULL
+                                                   DEFAULT '',
+                                               uri_fold TEXT NOT NULL
+                                                   DEFAULT '',
+                                               canonical TEXT
                                                )'''
+    # Uri variants share one entry, see utils.get_canonical_uri()
+    # Entries written before version 6 have a NULL canonical uri
+    # until migrated
+    __create_history_canonical_idx = '''CREATE UNIQUE INDEX IF NOT EXISTS
+                            idx_history_canonical ON history(canonical)'''
+    __create_history_score_idx = '''CREATE INDEX IF NOT EXISTS
+                                    idx_history_score ON history(score)'''
+    __create_history_mtime_idx = '''CREATE INDEX IF NOT EXISTS
+                                    idx_history_mtime ON history(mtime)'''
+    # One row per visit, aggregated in history popularity and score
+    __create_visits = '''CREATE TABLE visits (
+                                               id INTEGER PRIMARY KEY,
+                                               history_id INT NOT NULL,
+                                               mtime INT NOT NULL,
+                                               transition INT NOT NULL
+                                               )'''
+    __create_visits_history_idx = '''CREATE INDEX IF NOT EXISTS
+                                idx_visits_history ON visits(history_id)'''
+    __create_visits_mtime_idx = '''CREATE INDEX IF NOT EXISTS
+                                    idx_visits_mtime ON visits(mtime)'''
+    __create_visits_trigger = '''CREATE TRIGGER history_visits_delete
+                                 AFTER DELETE ON history
+                                 BEGIN
+                                     DELETE FROM visits
+                                     WHERE history_id=old.id;
+                                 END'''
 
     def __init__(self):
         """
             Create database tables or manage update if needed
         """
+        # Canonical uri: (uri, title, [(mtime, transition)])
+        self.__queue = {}
+        self.__queue_lock = Lock()
+        self.__write_lock = Lock()
+        self.__timeout_id = None
+        self.__prune_id = None
+        self.__search_queue = None
+        self.__search_cancellable = None
+        # Last search: (text, result), only if result was not truncated
+        self.__search_cache = None
+        # Bumped after each write, a search result is only cached if no
+        # write happened while searching
+        self.__write_generation = 0
+        self.__search_cache_lock = Lock()
+        self.__search_hits = 0
+        self.__search_misses = 0
+        # Built on first completion, visits during build are pending
+        self.__prefix_index = None
+        self.__prefix_pending = None
+        self.__fts_index = FtsIndex("history")
+        self.__fts = False
         f = Gio.File.new_for_path(self.DB_PATH)
         if not f.query_exists():
             try:
@@ -56,16 +131,36 @@ class DatabaseHistory:
                 # Create db schema
                 with SqlCursor(self) as sql:
                     sql.execute(self.__create_history)
+                    sql.execute(self.__create_history_canonical_idx)
+                    sql.execute(self.__create_history_score_idx)
+                    sql.execute(self.__create_history_mtime_idx)
+                    self.__create_visits_table(sql)
+                    self.__fts_index.create(sql)
+                    sql.execute("PRAGMA user_version=%s" % self.__VERSION)
                     sql.commit()
             except Exception as e:
                 print("DatabaseHistory::__init__(): %s" % e)
+        else:
+            self.__upgrade()
+        try:
+            # Main thread readers are not blocked by queue writer
+            with SqlCursor(self) as sql:
+                sql.execute("PRAGMA journal_mode=WAL")
+                self.__fts = self.__fts_index.exists(sql)
+        except Exception as e:
+            print("DatabaseHistory::__init__(): %s" % e)
+        thread = Thread(target=self.__migrate_canonical)
+        thread.daemon = True
+        thread.start()
+        self.__schedule_prune()
 
-    def add(self, title, uri, mtime=None):
+    def add(self, title, uri, mtime=None, transition=Transition.LINK):
         """
             Add a new entry to history, if exists, update it
             @param title as str
             @param uri as str
-            @param mtime as int
+            @param mtime as int, 0 to add entry without a visit
+            @param transition as Transition
         """
         if not uri:
             return
@@ -73,35 +168,159 @@ class DatabaseHistory:
             title = ""
         if mtime is None:
             mtime = int(time())
+        canonical = get_canonical_uri(uri)
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT popularity FROM history\
-                                  WHERE uri=?", (uri,))
-            v = result.fetchone()
-            if v is not None:
-                sql.execute("UPDATE history set mtime=?, popularity=?\
-                             WHERE uri=?", (int(time()), v[0]+1, uri))
-            else:
+            # Not a visit, bookmarked uris only need an entry
+            if mtime == 0:
                 sql.execute("INSERT INTO history\
-                                  (title, uri, mtime, popularity)\
-                                  VALUES (?, ?, ?, ?)",
-                            (title, uri, mtime, 0))
+                                  (title, uri, mtime, popularity, score,\
+                                   title_fold, uri_fold, canonical)\
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)\
+                             ON CONFLICT(canonical) DO NOTHING",
+                            (title, uri, mtime, 0, self.__get_score(mtime),
+                             fold(title), fold(uri), canonical))
+                sql.commit()
+                self.__on_written()
+                self.__add_to_prefix_index(uri, self.__get_score(mtime))
+                return
+            # One indexed lookup, no SELECT round trip
+            # Last visited variant is kept
+            sql.execute("INSERT INTO history\
+                              (title, uri, mtime, popularity, score,\
+                               title_fold, uri_fold, canonical)\
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)\
+                         ON CONFLICT(canonical) DO UPDATE\
+                              SET mtime=?, popularity=popularity+1,\
+                                  score=logaddexp(score, ?),\
+                                  uri=excluded.uri,\
+                                  uri_fold=excluded.uri_fold",
+                        (title, uri, mtime, 0, self.__get_score(mtime),
+                         fold(title), fold(uri), canonical,
+                         int(time()), self.__get_score(int(time()))))
+            sql.execute("INSERT INTO visits (history_id, mtime, transition)\
+                         SELECT id, ?, ? FROM history WHERE canonical=?",
+                        (int(time()), transition, canonical))
             sql.commit()
+        self.__on_written()
+        self.__add_to_prefix_index(uri, self.__get_score(mtime))
+        self.__schedule_prune()
+
+    def queue(self, title, uri, transition=Transition.LINK):
+        """
+            Queue a visit, written later by a background thread
+            Visits to the same uri or to its variants are merged
+            @param title as str
+            @param uri as str
+            @param transition as Transition
+        """
+        if not uri:
+            return
+        if title is None:
+            title = ""
+        canonical = get_canonical_uri(uri)
+        with self.__queue_lock:
+            (old_uri, old_title, visits) = self.__queue.get(canonical,
+                                                            (uri, title, []))
+            self.__queue[canonical] = (uri, old_title or title,
+                                       visits + [(int(time()), transition)])
+            size = len(self.__queue)
+        self.__add_to_prefix_index(uri, self.__get_score(int(time())))
+        self.__schedule_prune()
+        self.__schedule_flush(size)
+
+    def set_title(self, title, uri):
+        """
+            Queue a title update for uri entry, not a visit
+            @param title as str
+            @param uri as str
+        """
+        if not uri or not title:
+            return
+        canonical = get_canonical_uri(uri)
+        with self.__queue_lock:
+            (old_uri, old_title, visits) = self.__queue.get(canonical,
+                                                            (uri, title, []))
+            self.__queue[canonical] = (old_uri, title, visits)
+            size = len(self.__queue)
+        self.__schedule_flush(size)
+
+    def flush(self):
+        """
+            Write queued visits now, wait for running writer
+        """
+        if self.__timeout_id is not None:
+            GLib.source_remove(self.__timeout_id)
+            self.__timeout_id = None
+        self.__flush()
 
     def search(self, search):
         """
             Search string in db (uri and title)
+            If search extends previous one and previous result was
+            complete, previous result is filtered instead
             @param search as str
+            @return [(str, str)]
         """
-        with SqlCursor(self) as sql:
-            filter = '%' + search + '%'
-            result = sql.execute("SELECT title, uri\
-                                  FROM history\
-                                  WHERE title LIKE ?\
-                                   OR uri LIKE ?\
-                                  ORDER BY popularity DESC,\
-                                  mtime DESC LIMIT 50",
-                                 (filter, filter))
-            return list(result)
+        search = fold(search)
+        cache = self.__search_cache
+        if cache is not None and search.startswith(cache[0]):
+            self.__search_hits += 1
+            return [(title, uri)
+                    for (title, uri, title_fold, uri_fold) in cache[1]
+                    if search in title_fold or search in uri_fold]
+        self.__search_misses += 1
+        generation = self.__write_generation
+        result = self.__search(search)
+        with self.__search_cache_lock:
+            if len(result) > self.__SEARCH_LIMIT or\
+                    generation != self.__write_generation:
+                self.__search_cache = None
+            else:
+                self.__search_cache = (search, result)
+        result = result[:self.__SEARCH_LIMIT]
+        return [(title, uri) for (title, uri, title_fold, uri_fold) in result]
+
+    def complete(self, prefix):
+        """
+            Get best history host or uri starting with prefix, without
+            scheme and www, no db access
+            @param prefix as str
+            @return str/None, None until index is ready
+        """
+        if self.__prefix_index is None:
+            if self.__prefix_pending is None:
+                self.__prefix_pending = []
+                thread = Thread(target=self.__build_prefix_index)
+                thread.daemon = True
+                thread.start()
+            return None
+        # Host names are lowercase
+        if "/" not in prefix:
+            prefix = prefix.lower()
+        return self.__prefix_index.get(prefix)
+
+    def get_search_cache_stats(self):
+        """
+            Get search cache statistics
+            @return (hits as int, misses as int)
+        """
+        return (self.__search_hits, self.__search_misses)
+
+    def search_async(self, search, callback, cancellable, *args):
+        """
+            Search string in db in a worker thread
+            Nothing is returned if cancelled, running query is interrupted
+            @param search as str
+            @param callback as function(result as [(str, str)], *args),
+                   run in main loop
+            @param cancellable as Gio.Cancellable
+        """
+        if self.__search_queue is None:
+            self.__search_queue = Queue()
+            thread = Thread(target=self.__search_worker)
+            thread.daemon = True
+            thread.start()
+        self.__search_queue.put((search, callback, cancellable, args))
 
     def get_cursor(self):
         """
@@ -109,8 +328,8 @@ class DatabaseHistory:
         """
         try:
             c = sqlite3.connect(self.DB_PATH, 600.0)
-            c.create_collation('LOCALIZED', LocalizedCollation())
-            c.create_function("noaccents", 1, noaccents)
+            c.create_function("logaddexp", 2, logaddexp,
+                              deterministic=True)
             return c
         except:
             exit(-1)
@@ -128,3 +347,433 @@ class DatabaseHistory:
 #######################
 # PRIVATE             #
 #######################
+    def __search(self, search):
+        """
+            Search string in db, one more row than wanted is returned
+            to detect truncated results
+            @param search as str, folded
+            @return [(title as str, uri as str,
+                      folded title as str, folded uri as str)]
+        """
+        match = self.__fts_index.get_match(search)
+        with SqlCursor(self) as sql:
+            if self.__fts and match is not None:
+                result = sql.execute("SELECT history.title, history.uri,\
+                                             history.title_fold,\
+                                             history.uri_fold\
+                                      FROM history_fts, history\
+                                      WHERE history_fts MATCH ?\
+                                      AND history.id=history_fts.rowid\
+                                      ORDER BY score DESC LIMIT ?",
+                                     (match, self.__SEARCH_LIMIT + 1))
+                return list(result)
+            filter = '%' + search + '%'
+            result = sql.execute("SELECT title, uri, title_fold, uri_fold\
+                                  FROM history\
+                                  WHERE title_fold LIKE ?\
+                                   OR uri_fold LIKE ?\
+                                  ORDER BY score DESC LIMIT ?",
+                                 (filter, filter,
+                                  self.__SEARCH_LIMIT + 1))
+            return list(result)
+
+    def __on_written(self):
+        """
+            Drop cached search result, call it after commit
+        """
+        with self.__search_cache_lock:
+            self.__write_generation += 1
+            self.__search_cache = None
+
+    def __build_prefix_index(self):
+        """
+            Build prefix index from db
+        """
+        index = PrefixIndex()
+        try:
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT uri, score FROM history\
+                                      WHERE mtime != 0")
+                index.add_many((key, score) for (uri, score) in result
+                               for key in get_prefix_keys(uri))
+        except Exception as e:
+            print("DatabaseHistory::__build_prefix_index():", e)
+        GLib.idle_add(self.__on_prefix_index_built, index)
+
+    def __on_prefix_index_built(self, index):
+        """
+            Use new index, add visits done while building
+            @param index as PrefixIndex
+        """
+        for (uri, score) in self.__prefix_pending:
+            for key in get_prefix_keys(uri):
+                index.add(key, score)
+        self.__prefix_pending = None
+        self.__prefix_index = index
+
+    def __add_to_prefix_index(self, uri, score):
+        """
+            Add a visit to prefix index
+            @param uri as str
+            @param score as float
+        """
+        if self.__prefix_index is not None:
+            for key in get_prefix_keys(uri):
+                self.__prefix_index.add(key, score)
+        elif self.__prefix_pending is not None:
+            self.__prefix_pending.append((uri, score))
+
+    def __reset_prefix_index(self):
+        """
+            Drop prefix index, next completion rebuilds it
+        """
+        if self.__prefix_pending is None:
+            self.__prefix_index = None
+
+    def __schedule_flush(self, size):
+        """
+            Write queue later, now if it is full
+            @param size as int, queue size
+        """
+        if size >= self.__FLUSH_SIZE:
+            self.__start_flush()
+        elif self.__timeout_id is None:
+            self.__timeout_id = GLib.timeout_add(self.__FLUSH_DELAY,
+                                                 self.__on_flush_timeout)
+
+    def __start_flush(self):
+        """
+            Write queued visits in a background thread
+        """
+        if self.__timeout_id is not None:
+            GLib.source_remove(self.__timeout_id)
+            self.__timeout_id = None
+        thread = Thread(target=self.__flush)
+        thread.daemon = True
+        thread.start()
+
+    def __flush(self):
+        """
+            Write queued visits in one transaction
+        """
+        with self.__write_lock:
+            with self.__queue_lock:
+                (queue, self.__queue) = (self.__queue, {})
+            if not queue:
+                return
+            # Canonical uri, uri, title, visits count, last visit mtime
+            entries = [(canonical, uri, title, len(visits), visits[-1][0])
+                       for (canonical, (uri, title, visits))
+                       in queue.items() if visits]
+            titles = [(title, fold(title), canonical)
+                      for (canonical, (uri, title, visits))
+                      in queue.items() if not visits]
+            try:
+                with SqlCursor(self) as sql:
+                    # New rows get popularity 0 on first visit, like add()
+                    sql.executemany("INSERT INTO history\
+                                          (title, uri, mtime,\
+                                           popularity, score,\
+                                           title_fold, uri_fold, canonical)\
+                                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)\
+                                     ON CONFLICT(canonical) DO UPDATE\
+                                          SET mtime=?,\
+                                              popularity=popularity+?,\
+                                              score=logaddexp(score, ?),\
+                                              uri=excluded.uri,\
+                                              uri_fold=excluded.uri_fold,\
+                                              title=COALESCE(\
+                                                NULLIF(excluded.title, ''),\
+                                                title),\
+                                              title_fold=COALESCE(\
+                                                NULLIF(excluded.title_fold,\
+                                                       ''),\
+                                                title_fold)",
+                                    [(title, uri, mtime, count - 1,
+                                      self.__get_score(mtime, count),
+                                      fold(title), fold(uri), canonical,
+                                      mtime, count,
+                                      self.__get_score(mtime, count))
+                                     for (canonical, uri, title, count, mtime)
+                                     in entries])
+                    # One row per visit, as counted in popularity
+                    sql.executemany("INSERT INTO visits\
+                                          (history_id, mtime, transition)\
+                                     SELECT id, ?, ? FROM history\
+                                     WHERE canonical=?",
+                                    [(mtime, transition, canonical)
+                                     for (canonical, (uri, title, visits))
+                                     in queue.items()
+                                     for (mtime, transition) in visits])
+                    sql.executemany("UPDATE history SET title=?, title_fold=?\
+                                     WHERE canonical=?", titles)
+                    sql.commit()
+                self.__on_written()
+            except Exception as e:
+                print("DatabaseHistory::__flush():", e)
+
+    def __on_flush_timeout(self):
+        """
+            Flush queue
+        """
+        self.__timeout_id = None
+        self.__start_flush()
+
+    def __search_worker(self):
+        """
+            Run queued searches, one connection is kept for all of them
+        """
+        SqlCursor.add(self)
+        with SqlCursor(self) as sql:
+            sql.set_progress_handler(self.__on_search_progress, 1000)
+        while True:
+            (search, callback, cancellable, args) = self.__search_queue.get()
+            # User typed something else since
+            if cancellable.is_cancelled():
+                continue
+            self.__search_cancellable = cancellable
+            try:
+                result = self.search(search)
+                GLib.idle_add(self.__on_search_result, result,
+                              callback, cancellable, args)
+            except Exception as e:
+                if not cancellable.is_cancelled():
+                    print("DatabaseHistory::__search_worker():", e)
+            self.__search_cancellable = None
+
+    def __on_search_progress(self):
+        """
+            Interrupt running search if cancelled
+            @return bool
+        """
+        cancellable = self.__search_cancellable
+        return cancellable is not None and cancellable.is_cancelled()
+
+    def __on_search_result(self, result, callback, cancellable, args):
+        """
+            Send search result if still wanted
+            @param result as [(str, str)]
+            @param callback as function
+            @param cancellable as Gio.Cancellable
+            @param args as tuple
+        """
+        if not cancellable.is_cancelled():
+            callback(result, *args)
+
+    def __schedule_prune(self):
+        """
+            Prune history once browsing stopped for a while
+        """
+        if self.__prune_id is not None:
+            GLib.source_remove(self.__prune_id)
+        self.__prune_id = GLib.timeout_add_seconds(self.__PRUNE_DELAY,
+                                                   self.__on_prune_timeout,
+                                                   priority=GLib.PRIORITY_LOW)
+
+    def __prune(self, bookmarks_path):
+        """
+            Remove old visits and old entries not bookmarked
+            @param bookmarks_path as str
+        """
+        now = int(time())
+        visits_mtime = now - self.__VISITS_RETENTION * 24 * 3600
+        history_mtime = now - self.__HISTORY_RETENTION * 24 * 3600
+        with self.__write_lock:
+            try:
+                with SqlCursor(self) as sql:
+                    bookmarks = GLib.file_test(bookmarks_path,
+                                               GLib.FileTest.EXISTS)
+                    if bookmarks:
+                        sql.execute("ATTACH DATABASE ? AS bookmarks",
+                                    (bookmarks_path,))
+                    try:
+                        sql.execute("BEGIN IMMEDIATE")
+                        sql.execute("DELETE FROM visits WHERE mtime < ?",
+                                    (visits_mtime,))
+                        # Entries not migrated yet have a NULL canonical
+                        # uri, NOT IN is never true for them
+                        if bookmarks:
+                            sql.execute("DELETE FROM history WHERE mtime < ?\
+                                         AND canonical NOT IN\
+                                         (SELECT canonical\
+                                          FROM bookmarks.bookmarks)",
+                                        (history_mtime,))
+                        else:
+                            sql.execute("DELETE FROM history\
+                                         WHERE mtime < ?", (history_mtime,))
+                        sql.commit()
+                        self.__on_written()
+                        GLib.idle_add(self.__reset_prefix_index)
+                    except:
+                        sql.rollback()
+                        raise
+            except Exception as e:
+                print("DatabaseHistory::__prune():", e)
+
+    def __on_prune_timeout(self):
+        """
+            Prune history in a background thread
+        """
+        self.__prune_id = None
+        thread = Thread(target=self.__prune, args=(El().bookmarks.DB_PATH,))
+        thread.daemon = True
+        thread.start()
+
+    def __upgrade(self):
+        """
+            Upgrade database schema to current version
+        """
+        # Full text index of upgrade 2 now needs upgrade 5 columns
+        upgrades = {1: self.__upgrade_1,
+                    2: None,
+                    3: self.__upgrade_3,
+                    4: self.__create_visits_table,
+                    5: self.__upgrade_5,
+                    6: self.__upgrade_6}
+        try:
+            with SqlCursor(self) as sql:
+                upgrade_schema(sql, upgrades, self.__VERSION)
+        except Exception as e:
+            print("DatabaseHistory::__upgrade():", e)
+
+    def __upgrade_1(self, sql):
+        """
+            Merge duplicated uris
+            @param sql as sqlite3.Connection
+        """
+        result = sql.execute("SELECT MIN(rowid), SUM(popularity) +\
+                                     COUNT(*) - 1, MAX(mtime)\
+                              FROM history\
+                              GROUP BY uri HAVING COUNT(*) > 1")
+        sql.executemany("UPDATE history SET popularity=?, mtime=?\
+                         WHERE rowid=?",
+                        [(popularity, mtime, rowid)
+                         for (rowid, popularity, mtime) in result])
+        sql.execute("DELETE FROM history WHERE rowid NOT IN\
+                     (SELECT MIN(rowid) FROM history GROUP BY uri)")
+
+    def __upgrade_3(self, sql):
+        """
+            Add frecency score, estimated from visits count and last visit
+            @param sql as sqlite3.Connection
+        """
+        sql.execute("ALTER TABLE history ADD COLUMN\
+                     score REAL NOT NULL DEFAULT 0")
+        result = sql.execute("SELECT rowid, mtime, popularity FROM history")
+        sql.executemany("UPDATE history SET score=? WHERE rowid=?",
+                        [(self.__get_score(mtime, popularity + 1), rowid)
+                         for (rowid, mtime, popularity) in list(result)])
+        sql.execute(self.__create_history_score_idx)
+        sql.execute(self.__create_history_mtime_idx)
+
+    def __upgrade_5(self, sql):
+        """
+            Add folded title and uri, index them for full text search
+            @param sql as sqlite3.Connection
+        """
+        self.__fts_index.drop(sql)
+        sql.execute("ALTER TABLE history ADD COLUMN\
+                     title_fold TEXT NOT NULL DEFAULT ''")
+        sql.execute("ALTER TABLE history ADD COLUMN\
+                     uri_fold TEXT NOT NULL DEFAULT ''")
+        result = sql.execute("SELECT rowid, title, uri FROM history")
+        sql.executemany("UPDATE history SET title_fold=?, uri_fold=?\
+                         WHERE rowid=?",
+                        [(fold(title), fold(uri), rowid)
+                         for (rowid, title, uri) in list(result)])
+        if self.__fts_index.create(sql):
+            self.__fts_index.rebuild(sql)
+
+    def __upgrade_6(self, sql):
+        """
+            Add canonical uri, entries are merged later by
+            __migrate_canonical() as it may take a while
+            @param sql as sqlite3.Connection
+        """
+        sql.execute("DROP INDEX IF EXISTS idx_history_uri")
+        sql.execute("ALTER TABLE history ADD COLUMN canonical TEXT")
+        sql.execute(self.__create_history_canonical_idx)
+
+    def __migrate_canonical(self):
+        """
+            Set canonical uri on entries written before version 6,
+            merging variants, in small transactions so writers are not
+            blocked for long
+        """
+        try:
+            while self.__migrate_canonical_batch():
+                pass
+        except Exception as e:
+            print("DatabaseHistory::__migrate_canonical():", e)
+
+    def __migrate_canonical_batch(self):
+        """
+            Migrate some entries, see __migrate_canonical()
+            @return True if entries were migrated
+        """
+        with self.__write_lock:
+            with SqlCursor(self) as sql:
+                try:
+                    sql.execute("BEGIN IMMEDIATE")
+                    result = sql.execute("SELECT id, uri, mtime,\
+                                                 popularity, score\
+                                          FROM history\
+                                          WHERE canonical IS NULL LIMIT ?",
+                                         (self.__CANONICAL_BATCH,))
+                    rows = list(result)
+                    for (rowid, uri, mtime, popularity, score) in rows:
+                        canonical = get_canonical_uri(uri)
+                        result = sql.execute("SELECT id FROM history\
+                                              WHERE canonical=?",
+                                             (canonical,))
+                        v = result.fetchone()
+                        if v is None:
+                            sql.execute("UPDATE history SET canonical=?\
+                                         WHERE id=?", (canonical, rowid))
+                            continue
+                        # Merge into entry, keep last visited variant
+                        sql.execute("UPDATE history\
+                                     SET popularity=popularity+?+1,\
+                                         score=logaddexp(score, ?),\
+                                         uri=CASE WHEN ? > mtime\
+                                             THEN ? ELSE uri END,\
+                                         uri_fold=CASE WHEN ? > mtime\
+                                             THEN ? ELSE uri_fold END,\
+                                         mtime=MAX(mtime, ?)\
+                                     WHERE id=?",
+                                    (popularity, score, mtime, uri,
+                                     mtime, fold(uri), mtime, v[0]))
+                        sql.execute("UPDATE visits SET history_id=?\
+                                     WHERE history_id=?", (v[0], rowid))
+                        sql.execute("DELETE FROM history WHERE id=?",
+                                    (rowid,))
+                    sql.commit()
+                except:
+                    sql.rollback()
+                    raise
+        if rows:
+            self.__on_written()
+            GLib.idle_add(self.__reset_prefix_index)
+        return bool(rows)
+
+    def __create_visits_table(self, sql):
+        """
+            Create visits table
+            @param sql as sqlite3.Connection
+        """
+        sql.execute(self.__create_visits)
+        sql.execute(self.__create_visits_history_idx)
+        sql.execute(self.__create_visits_mtime_idx)
+        sql.execute(self.__create_visits_trigger)
+
+    def __get_score(self, mtime, count=1):
+        """
+            Get frecency score for visits at mtime
+            Score is log(sum(2^(visit mtime / half life))): it does not
+            change with time, so it can be indexed, and visit order still
+            follows decayed visits count
+            @param mtime as int
+            @param count as int
+            @return float
+        """
+        return mtime * log(2) / self.__HALF_LIFE + log(count)
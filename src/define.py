@@ -21,6 +21,28 @@ class ArtSize:
     PREVIEW_WIDTH_MARGIN = 10
 
 
+class AdblockStats:
+    """
+        D-Bus signal web extensions send adblock statistics with, to UI
+        process only:
+        (sa(tuut)): token given to web extensions, then for each page:
+        page id, requests seen, requests blocked, match time (us)
+    """
+    PATH = "/org/gnome/Eolie/Adblock"
+    INTERFACE = "org.gnome.Eolie.Adblock"
+    SIGNAL = "Stats"
+
+
+class Transition:
+    """
+        How a history visit happened
+    """
+    LINK = 0
+    TYPED = 1
+    REDIRECT = 2
+    BOOKMARK = 3
+
+
 class BookmarksType:
     POPULARS = -1
     RECENTS = -2
@@ -1,26 +0,0 @@
-# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
-# This program is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-# This program is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
-# GNU General Public License for more details.
-# You should have received a copy of the GNU General Public License
-# along with this program. If not, see <http://www.gnu.org/licenses/>.
-
-from locale import strcoll
-
-
-class LocalizedCollation(object):
-    """
-        COLLATE LOCALIZED missing from default sqlite installation
-        Android only
-    """
-
-    def __init__(self):
-        pass
-
-    def __call__(self, v1, v2):
-        return strcoll(v1, v2)
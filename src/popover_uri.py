@@ -14,7 +14,8 @@ from gi.repository import Gtk, Gdk, GLib, GObject, Gio, Pango
 
 from gettext import gettext as _
 
-from eolie.define import El, ArtSize, BookmarksType
+from eolie.define import El, ArtSize, BookmarksType, Transition
+from eolie.utils import debug
 
 
 class Item(GObject.GObject):
@@ -131,6 +132,7 @@ class UriPopover(Gtk.Popover):
         """
         Gtk.Popover.__init__(self)
         self.__input = False
+        self.__cancellable = Gio.Cancellable.new()
         self.set_modal(False)
         builder = Gtk.Builder()
         builder.add_from_resource('/org/gnome/Eolie/PopoverUri.ui')
@@ -173,7 +175,12 @@ class UriPopover(Gtk.Popover):
             child.destroy()
         # self.__history_model.remove_all()
         self.__stack.set_visible_child_name("search")
-        self.__set_history_text(search)
+        # Drop results for previous text
+        self.__cancellable.cancel()
+        self.__cancellable = Gio.Cancellable.new()
+        El().history.search_async(search,
+                                  self.__on_history_search,
+                                  self.__cancellable)
 
     def add_keywords(self, words):
         """
@@ -281,7 +288,9 @@ class UriPopover(Gtk.Popover):
                     uri = selected.item.get_property("uri")
                     if uri:
                         El().active_window.toolbar.title.hide_popover()
-                        El().active_window.container.current.load_uri(uri)
+                        El().active_window.container.current.load_uri(
+                                                            uri,
+                                                            Transition.TYPED)
                 return True
             else:
                 self.__input = Input.NONE
@@ -366,12 +375,13 @@ class UriPopover(Gtk.Popover):
             box = self.__bookmarks_box
         return box
 
-    def __set_history_text(self, search):
+    def __on_history_search(self, result):
         """
             Set history model
-            @param search as str
+            @param result as [(str, str)]
         """
-        result = El().history.search(search)
+        debug("History: search cache %s hits, %s misses" %
+              El().history.get_search_cache_stats())
         for (title, uri) in result:
             item = Item()
             item.set_property("title", title)
@@ -0,0 +1,133 @@
+# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left, insort
+
+from eolie.utils import logaddexp
+
+
+def get_prefix_keys(uri):
+    """
+        Get keys for uri: its host and itself, without scheme and www
+        @param uri as str
+        @return [str]
+    """
+    for scheme in ["http://", "https://"]:
+        if uri.startswith(scheme):
+            uri = uri[len(scheme):]
+            break
+    else:
+        return []
+    if uri.startswith("www."):
+        uri = uri[4:]
+    host = uri.split("/", 1)[0]
+    if not host:
+        return []
+    path = uri[len(host):]
+    host = host.lower()
+    keys = [host + "/"]
+    if path and path != "/":
+        keys.append(host + path)
+    return keys
+
+
+class PrefixIndex:
+    """
+        Sorted keys with frecency scores, scores are log values merged
+        with logaddexp, see DatabaseHistory
+        Keys are "host/" or "host/path", see get_prefix_keys(): best key
+        is precomputed for each prefix of "host/", so a lookup only scans
+        keys of one host
+    """
+
+    def __init__(self):
+        """
+            Init index
+        """
+        self.__keys = []
+        self.__scores = {}
+        # Prefix of "host/": best key starting with it
+        self.__best = {}
+
+    def add(self, key, score):
+        """
+            Add score to key
+            @param key as str
+            @param score as float
+        """
+        old = self.__scores.get(key)
+        if old is None:
+            insort(self.__keys, key)
+            self.__scores[key] = score
+        else:
+            self.__scores[key] = logaddexp(old, score)
+        self.__update_best(key)
+
+    def add_many(self, items):
+        """
+            Add scores to keys, faster than add() for a lot of keys
+            @param items as iterable of (str, float)
+        """
+        for (key, score) in items:
+            old = self.__scores.get(key)
+            if old is None:
+                self.__scores[key] = score
+            else:
+                self.__scores[key] = logaddexp(old, score)
+        self.__keys = sorted(self.__scores.keys())
+        self.__best = {}
+        for key in self.__keys:
+            self.__update_best(key)
+
+    def get(self, prefix):
+        """
+            Get best scored key starting with prefix
+            @param prefix as str
+            @return str/None
+        """
+        slash = prefix.find("/")
+        if slash == -1 or slash == len(prefix) - 1:
+            return self.__best.get(prefix)
+        best = None
+        best_score = None
+        start = bisect_left(self.__keys, prefix)
+        for i in range(start, len(self.__keys)):
+            key = self.__keys[i]
+            if not key.startswith(prefix):
+                break
+            score = self.__scores[key]
+            if best_score is None or score > best_score:
+                best = key
+                best_score = score
+        return best
+
+    def __len__(self):
+        """
+            Keys count
+            @return int
+        """
+        return len(self.__keys)
+
+#######################
+# PRIVATE             #
+#######################
+    def __update_best(self, key):
+        """
+            Update best keys for prefixes of key host, scores only grow
+            @param key as str
+        """
+        score = self.__scores[key]
+        for i in range(1, key.find("/") + 2):
+            prefix = key[:i]
+            best = self.__best.get(prefix)
+            if best is None or score > self.__scores[best]:
+                self.__best[prefix] = key
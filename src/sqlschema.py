@@ -0,0 +1,134 @@
+# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+
+
+def upgrade_schema(sql, upgrades, version):
+    """
+        Upgrade main database schema to version in one transaction,
+        schema version is stored in PRAGMA user_version
+        @param sql as sqlite3.Connection
+        @param upgrades as {int: function(sql)/None}, None if nothing to do
+        @param version as int
+    """
+    result = sql.execute("PRAGMA main.user_version")
+    current = result.fetchone()[0]
+    if current >= version:
+        return
+    try:
+        sql.execute("BEGIN IMMEDIATE")
+        for i in range(current + 1, version + 1):
+            if upgrades[i] is not None:
+                upgrades[i](sql)
+        sql.execute("PRAGMA main.user_version=%s" % version)
+        sql.commit()
+    except:
+        sql.rollback()
+        raise
+
+
+class FtsIndex:
+    """
+        Full text index on folded title and uri of a table, see utils.fold()
+        Index is named table_fts and kept in sync by triggers
+        Trigrams match any substring
+    """
+    __CREATE = '''CREATE VIRTUAL TABLE %(fts)s USING fts5(
+                                               title_fold,
+                                               uri_fold,
+                                               content='%(table)s',
+                                               content_rowid='id',
+                                               tokenize='trigram'
+                                               )'''
+    __TRIGGERS = {
+        "insert": '''CREATE TRIGGER %(fts)s_insert AFTER INSERT ON %(table)s
+           BEGIN
+               INSERT INTO %(fts)s (rowid, title_fold, uri_fold)
+               VALUES (new.id, new.title_fold, new.uri_fold);
+           END''',
+        "delete": '''CREATE TRIGGER %(fts)s_delete AFTER DELETE ON %(table)s
+           BEGIN
+               INSERT INTO %(fts)s (%(fts)s, rowid, title_fold, uri_fold)
+               VALUES ('delete', old.id, old.title_fold, old.uri_fold);
+           END''',
+        "update": '''CREATE TRIGGER %(fts)s_update
+           AFTER UPDATE OF title_fold, uri_fold ON %(table)s
+           BEGIN
+               INSERT INTO %(fts)s (%(fts)s, rowid, title_fold, uri_fold)
+               VALUES ('delete', old.id, old.title_fold, old.uri_fold);
+               INSERT INTO %(fts)s (rowid, title_fold, uri_fold)
+               VALUES (new.id, new.title_fold, new.uri_fold);
+           END'''}
+
+    def __init__(self, table):
+        """
+            Init index
+            @param table as str, with id, title_fold and uri_fold columns
+        """
+        self.__names = {"table": table, "fts": table + "_fts"}
+
+    def create(self, sql):
+        """
+            Create index, searches should fall back to LIKE without it
+            @param sql as sqlite3.Connection
+            @return True if created
+        """
+        try:
+            sql.execute(self.__CREATE % self.__names)
+        except sqlite3.OperationalError as e:
+            # SQLite < 3.34 has no trigram tokenizer
+            print("FtsIndex::create():", e)
+            return False
+        for trigger in self.__TRIGGERS.values():
+            sql.execute(trigger % self.__names)
+        return True
+
+    def drop(self, sql):
+        """
+            Drop index and its triggers if they exist
+            @param sql as sqlite3.Connection
+        """
+        for name in self.__TRIGGERS.keys():
+            sql.execute("DROP TRIGGER IF EXISTS main.%s_%s" %
+                        (self.__names["fts"], name))
+        sql.execute("DROP TABLE IF EXISTS main.%s" % self.__names["fts"])
+
+    def rebuild(self, sql):
+        """
+            Index existing rows
+            @param sql as sqlite3.Connection
+        """
+        sql.execute("INSERT INTO %(fts)s (%(fts)s) VALUES ('rebuild')" %
+                    self.__names)
+
+    def exists(self, sql):
+        """
+            True if index exists
+            @param sql as sqlite3.Connection
+            @return bool
+        """
+        result = sql.execute("SELECT name FROM main.sqlite_master\
+                              WHERE name=?", (self.__names["fts"],))
+        return result.fetchone() is not None
+
+    def get_match(self, search):
+        """
+            Get MATCH argument for search
+            @param search as str, folded
+            @return str/None if index can not be used
+        """
+        # Trigrams need at least 3 characters
+        if len(search) < 3:
+            return None
+        # A quoted string matches as a substring
+        return '"%s"' % search.replace('"', '""')
@@ -12,6 +12,8 @@
 
 from gi.repository import Gtk, GLib
 
+from gettext import gettext as _
+
 from eolie.define import El
 from eolie.popover_downloads import DownloadsPopover
 
@@ -54,11 +56,28 @@ class ToolbarEnd(Gtk.Bin):
                                        self.__on_download_changed)
         eventbox.add(self.__progress)
         builder.get_object('overlay').add_overlay(eventbox)
+        self.__adblock_button = builder.get_object('adblock_button')
         if El().settings.get_value('adblock'):
-            builder.get_object(
-                         'adblock_button').get_style_context().add_class('red')
+            self.__adblock_button.get_style_context().add_class('red')
         self.add(builder.get_object('end'))
 
+    def update_adblock_stats(self, view):
+        """
+            Show adblock statistics for view
+            @param view as WebView
+        """
+        stats = El().adblock_stats.get(view.get_page_id())
+        if El().adblock.is_exception(view.get_uri()):
+            self.__adblock_button.set_tooltip_text(
+                _("Ads allowed on this site, right click to hide them"))
+        elif stats is None or not stats[0]:
+            self.__adblock_button.set_tooltip_text(_("Hide ads"))
+        else:
+            (seen, blocked, match_us) = stats
+            self.__adblock_button.set_tooltip_text(
+                _("Hide ads: %s of %s requests blocked (%.1f ms)") %
+                (blocked, seen, match_us / 1000))
+
 #######################
 # PROTECTED           #
 #######################
@@ -84,6 +103,23 @@ class ToolbarEnd(Gtk.Bin):
         else:
             button.get_style_context().remove_class('red')
 
+    def _on_adblock_button_release_event(self, button, event):
+        """
+            Allow/hide ads on current site on right click
+            @param button as Gtk.Button
+            @param event as Gdk.EventButton
+        """
+        if event.button != 3:
+            return False
+        view = self.get_toplevel().container.current
+        uri = view.get_uri()
+        if uri:
+            El().set_adblock_exception(uri,
+                                       not El().adblock.is_exception(uri))
+            self.update_adblock_stats(view)
+            view.reload()
+        return True
+
 #######################
 # PRIVATE             #
 #######################
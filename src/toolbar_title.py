@@ -15,7 +15,7 @@ from gi.repository import Gtk, Gdk, GLib, Gio
 from threading import Thread
 from gettext import gettext as _
 
-from eolie.define import El
+from eolie.define import El, Transition
 from eolie.popover_uri import UriPopover
 
 
@@ -33,6 +33,8 @@ class ToolbarTitle(Gtk.Bin):
         self.__lock = False
         self.__in_notify = False
         self.__signal_id = None
+        # Text typed by user, without inline completion
+        self.__typed = ""
         self.__keywords_timeout = None
         self.__keywords_cancellable = Gio.Cancellable.new()
         builder = Gtk.Builder()
@@ -172,6 +174,7 @@ class ToolbarTitle(Gtk.Bin):
         self.__entry.get_style_context().add_class('input')
         self.__popover.set_relative_to(self)
         self.__popover.show()
+        self.__typed = self.__uri
         self.__signal_id = self.__entry.connect('changed',
                                                 self.__on_entry_changed)
 
@@ -242,7 +245,7 @@ class ToolbarTitle(Gtk.Bin):
         uri = entry.get_text()
         if El().search.is_search(uri):
             uri = El().search.get_search_uri(uri)
-        El().active_window.container.load_uri(uri)
+        El().active_window.container.load_uri(uri, Transition.TYPED)
 
 #######################
 # PRIVATE             #
@@ -271,11 +274,34 @@ class ToolbarTitle(Gtk.Bin):
                 GLib.idle_add(self.__popover.add_keywords,
                               words.replace('"', ''))
 
+    def __complete(self, value):
+        """
+            Complete entry with best history host or uri, completion is
+            selected so typing replaces it
+            @param value as str
+        """
+        if self.__entry.get_text() != value:
+            return
+        completion = El().history.complete(value)
+        if completion is None or completion == value or\
+                not completion.startswith(value):
+            return
+        self.__entry.handler_block(self.__signal_id)
+        self.__entry.set_text(completion)
+        self.__entry.handler_unblock(self.__signal_id)
+        self.__entry.select_region(len(value), -1)
+
     def __on_entry_changed(self, entry):
         """
             Update popover search if needed
         """
         value = entry.get_text()
+        # Do not complete again text being deleted
+        if value and not self.__typed.startswith(value) and\
+                " " not in value:
+            # Wait for entry to move cursor after insertion
+            GLib.idle_add(self.__complete, value)
+        self.__typed = value
         if value == self.__uri:
             self.__popover.set_history_text("")
         else:
@@ -11,6 +11,8 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import unicodedata
+from math import log1p, exp
+from urllib.parse import urlsplit
 
 from eolie.define import El
 
@@ -25,6 +27,64 @@ def noaccents(string):
         return u"".join([c for c in nfkd_form if not unicodedata.combining(c)])
 
 
+def fold(string):
+    """
+        Return string without accents and case, for searches
+        @param string as str
+        @return str
+    """
+    return noaccents(string).casefold()
+
+
+def get_canonical_uri(uri):
+    """
+        Return a key shared by uri variants: http and https, default port,
+        trailing slash, fragment and tracking parameters are ignored
+        Other schemes are returned as is
+        @param uri as str
+        @return str
+    """
+    try:
+        parsed = urlsplit(uri)
+    except ValueError:
+        return uri
+    if parsed.scheme not in ["http", "https"]:
+        return uri
+    host = parsed.netloc.lower()
+    for port in [":80", ":443"]:
+        if host.endswith(port):
+            host = host[:-len(port)]
+    params = [param for param in parsed.query.split("&")
+              if param and not _is_tracking_param(param.split("=", 1)[0])]
+    canonical = "//" + host + parsed.path.rstrip("/")
+    if params:
+        canonical += "?" + "&".join(params)
+    return canonical
+
+
+def _is_tracking_param(name):
+    """
+        True if query parameter name is only used for tracking
+        @param name as str
+        @return bool
+    """
+    return name.startswith("utm_") or\
+        name in ["fbclid", "gclid", "dclid", "msclkid",
+                 "mc_cid", "mc_eid", "igshid", "yclid"]
+
+
+def logaddexp(a, b):
+    """
+        Return log(exp(a) + exp(b)) without overflow
+        @param a as float
+        @param b as float
+        @return float
+    """
+    if a < b:
+        (a, b) = (b, a)
+    return a + log1p(exp(b - a))
+
+
 def debug(str):
     """
         Print debug
@@ -12,7 +12,7 @@
 
 from gi.repository import WebKit2
 
-from eolie.define import El
+from eolie.define import El, Transition
 
 
 class WebView(WebKit2.WebView):
@@ -26,6 +26,7 @@ class WebView(WebKit2.WebView):
         """
         WebKit2.WebView.__init__(self)
         self.__loaded_uri = ""
+        self.__transition = Transition.LINK
         settings = self.get_settings()
         settings.set_property("allow-file-access-from-file-urls",
                               False)
@@ -46,17 +47,22 @@ class WebView(WebKit2.WebView):
                               True)
         settings.set_property("media-playback-allows-inline", True)
         self.set_settings(settings)
+        El().set_content_filter(self)
         self.show()
         self.connect('decide-policy', self.__on_decide_policy)
+        self.connect('load-changed', self.__on_load_changed)
+        self.connect('destroy', self.__on_destroy)
         self.get_context().connect('download-started',
                                    self.__on_download_started)
 
-    def load_uri(self, uri):
+    def load_uri(self, uri, transition=Transition.LINK):
         """
             Load uri
             @param uri as str
+            @param transition as Transition
         """
         self.__loaded_uri = uri
+        self.__transition = transition
         if not uri.startswith("http://") and not uri.startswith("https://"):
             uri = "http://" + uri
         WebKit2.WebView.load_uri(self, uri)
@@ -69,6 +75,14 @@ class WebView(WebKit2.WebView):
         """
         return self.__loaded_uri
 
+    @property
+    def transition(self):
+        """
+            Return how loaded uri was reached
+            @return Transition
+        """
+        return self.__transition
+
 #######################
 # PRIVATE             #
 #######################
@@ -80,6 +94,22 @@ class WebView(WebKit2.WebView):
         """
         El().downloads_manager.add(download)
 
+    def __on_destroy(self, view):
+        """
+            Drop adblock statistics
+            @param view as WebKit2.WebView
+        """
+        El().adblock_stats.pop(self.get_page_id(), None)
+
+    def __on_load_changed(self, view, event):
+        """
+            Hide ads elements for new document
+            @param view as WebKit2.WebView
+            @param event as WebKit2.LoadEvent
+        """
+        if event == WebKit2.LoadEvent.COMMITTED:
+            El().set_adblock_style_sheets(self)
+
     def __on_decide_policy(self, view, decision, decision_type):
         """
             Navigation policy
@@ -103,6 +133,7 @@ class WebView(WebKit2.WebView):
             return False
         elif decision.get_mouse_button() == 1:
             self.__loaded_uri = uri
+            self.__transition = Transition.LINK
             decision.use()
             return False
         else:
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# Copyright (c) 2014-2016 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    Adblock benchmark, runs without display and without network
+
+    Build a synthetic blocklist, replay a request corpus through each
+    lookup strategy and report throughput plus p50/p99 latencies.
+    Full list ingest is timed against a local HTTP server.
+
+    ./tools/adblock_benchmark.py --hosts 1000000 --requests 200000
+    ./tools/adblock_benchmark.py --save-corpus corpus.txt
+    ./tools/adblock_benchmark.py --corpus corpus.txt
+"""
+
+from argparse import ArgumentParser
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+from threading import Thread, enumerate as enumerate_threads
+from random import Random
+from time import perf_counter, perf_counter_ns
+from urllib.parse import urlparse
+import tempfile
+import sqlite3
+import sys
+import os
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "src")
+WORDS = ["ads", "cdn", "static", "track", "pixel", "media", "img", "api",
+         "stats", "metrics", "beacon", "assets", "fonts", "news", "shop"]
+TLDS = ["com", "net", "org", "io", "fr", "de", "co.uk"]
+PATHS = ["/", "/index.html", "/js/app.js", "/css/main.css",
+         "/img/logo.png", "/banner/top.gif", "/adserver/show?id=1",
+         "/fonts/font.woff2", "/api/v1/items?page=2"]
+
+
+def setup_modules(path):
+    """
+        Make eolie modules from source tree importable
+        @param path as str, a temporary directory
+    """
+    os.symlink(os.path.abspath(SRC_PATH), os.path.join(path, "eolie"))
+    sys.path.insert(0, path)
+    # DatabaseAdblock paths are computed at import time
+    os.environ["XDG_DATA_HOME"] = path
+
+
+def get_host(rand, i):
+    """
+        Get a synthetic host
+        @param rand as Random
+        @param i as int
+        @return str
+    """
+    return "%s%d.%s.%s" % (rand.choice(WORDS), i,
+                           rand.choice(WORDS), rand.choice(TLDS))
+
+
+def get_blocklist(rand, count):
+    """
+        Get synthetic blocklist
+        @param rand as Random
+        @param count as int
+        @return [str]
+    """
+    return [get_host(rand, i) for i in range(count)]
+
+
+def get_filters(rand, hosts, count):
+    """
+        Get synthetic Adblock Plus filters
+        @param rand as Random
+        @param hosts as [str]
+        @param count as int
+        @return [str]
+    """
+    filters = ["/banner/*$image", "/adserver/*", "@@||safe.org^$document"]
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            filters.append("||%s^$third-party" % rand.choice(hosts))
+        elif kind == 1:
+            filters.append("/%s%d/*$script" % (rand.choice(WORDS), i))
+        else:
+            filters.append("||%s/%s^" % (rand.choice(hosts),
+                                         rand.choice(WORDS)))
+    return filters
+
+
+def get_corpus(rand, hosts, count):
+    """
+        Get a request corpus: a small hot set of hosts is hit very often,
+        about one request in ten targets a blocked host or subdomain
+        @param rand as Random
+        @param hosts as [str]
+        @param count as int
+        @return [(str, str)], (uri, page uri)
+    """
+    hot = [get_host(rand, count + i) for i in range(200)]
+    pages = ["https://%s/" % get_host(rand, 2 * count + i)
+             for i in range(50)]
+    corpus = []
+    for i in range(count):
+        draw = rand.random()
+        if draw < 0.1:
+            host = rand.choice(hosts)
+            if rand.random() < 0.5:
+                host = "%s.%s" % (rand.choice(WORDS), host)
+        elif draw < 0.8:
+            host = hot[int(rand.paretovariate(1.2)) % len(hot)]
+        else:
+            host = get_host(rand, 3 * count + i)
+        corpus.append(("https://%s%s" % (host, rand.choice(PATHS)),
+                       rand.choice(pages)))
+    return corpus
+
+
+def load_corpus(path):
+    """
+        Load corpus from file, one "uri page_uri" per line
+        @param path as str
+        @return [(str, str)]
+    """
+    corpus = []
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                corpus.append((fields[0], fields[1]))
+            elif len(fields) == 1:
+                corpus.append((fields[0], None))
+    return corpus
+
+
+def save_corpus(path, corpus):
+    """
+        Save corpus to file
+        @param path as str
+        @param corpus as [(str, str)]
+    """
+    with open(path, "w") as f:
+        for (uri, page_uri) in corpus:
+            f.write("%s %s\n" % (uri, page_uri or ""))
+
+
+def get_suffixes_lookup(hosts):
+    """
+        Get a lookup function using parent domain matching on hosts
+        @param hosts as container
+        @return function
+    """
+    from eolie.adblock_index import host_suffixes
+
+    def lookup(uri, page_uri):
+        host = urlparse(uri).hostname
+        if host is None:
+            return False
+        for suffix in host_suffixes(host):
+            if suffix in hosts:
+                return True
+        return False
+    return lookup
+
+
+def get_sqlite_lookup(path, hosts):
+    """
+        Get a lookup function doing one SELECT per request, as before
+        @param path as str
+        @param hosts as [str]
+        @return function
+    """
+    sql = sqlite3.connect(path)
+    sql.execute("CREATE TABLE adblock (id INTEGER PRIMARY KEY,\
+                                       dns TEXT NOT NULL,\
+                                       mtime INT NOT NULL)")
+    sql.executemany("INSERT INTO adblock (dns, mtime) VALUES (?, 0)",
+                    ((host,) for host in hosts))
+    sql.commit()
+
+    def lookup(uri, page_uri):
+        result = sql.execute("SELECT mtime FROM adblock WHERE dns=?",
+                             (urlparse(uri).netloc,))
+        return result.fetchone() is not None
+    return lookup
+
+
+def get_extension_lookup(hosts, filters):
+    """
+        Get DatabaseAdblock.is_blocked(), as used by the web extension
+        @param hosts as [str]
+        @param filters as [str]
+        @return (function, DatabaseAdblock) or (None, None)
+    """
+    from eolie.adblock_index import AdblockIndex
+    from eolie.adblock_filters import AdblockFilters
+    try:
+        from gi.repository import Gio
+        from eolie.database_adblock import DatabaseAdblock
+    except Exception as e:
+        print("Skipping extension path:", e)
+        return (None, None)
+    app = Gio.Application.new(None, Gio.ApplicationFlags.IS_SERVICE)
+    app.cursors = {}
+    app.debug = False
+    os.makedirs(os.path.dirname(DatabaseAdblock.INDEX_PATH), exist_ok=True)
+    AdblockIndex.write(DatabaseAdblock.INDEX_PATH, hosts, 1)
+    with open(DatabaseAdblock.FILTERS_PATH, "w") as f:
+        f.write("\n".join(filters))
+    AdblockFilters.write(DatabaseAdblock.FILTERS_INDEX_PATH, filters)
+    adblock = DatabaseAdblock()
+    return (adblock.is_blocked, adblock)
+
+
+def replay(name, lookup, corpus):
+    """
+        Replay corpus through lookup and print statistics
+        @param name as str
+        @param lookup as function
+        @param corpus as [(str, str)]
+    """
+    # Warm up, load lazy structures
+    lookup(corpus[0][0], corpus[0][1])
+    timings = []
+    blocked = 0
+    start = perf_counter()
+    for (uri, page_uri) in corpus:
+        before = perf_counter_ns()
+        if lookup(uri, page_uri):
+            blocked += 1
+        timings.append(perf_counter_ns() - before)
+    elapsed = perf_counter() - start
+    timings.sort()
+    print("%-22s %10.0f req/s  p50 %7.2f us  p99 %7.2f us  blocked %d" %
+          (name, len(corpus) / elapsed,
+           timings[len(timings) // 2] / 1000,
+           timings[int(len(timings) * 0.99)] / 1000,
+           blocked))
+
+
+def time_ingest(hosts, filters, directory):
+    """
+        Time a full list ingest served by a local HTTP server
+        @param hosts as [str]
+        @param filters as [str]
+        @param directory as str
+    """
+    try:
+        from eolie.database_adblock import DatabaseAdblock
+    except Exception as e:
+        print("Skipping ingest:", e)
+        return
+    with open(os.path.join(directory, "hosts.txt"), "w") as f:
+        f.write("\n".join("0.0.0.0 %s" % host for host in hosts))
+    with open(os.path.join(directory, "easylist.txt"), "w") as f:
+        f.write("\n".join(filters))
+    handler = partial(SimpleHTTPRequestHandler, directory=directory)
+    handler.log_message = lambda *args: None
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base = "http://127.0.0.1:%d" % server.server_port
+    # Cold: GET lists, parse, diff against empty table, compile index
+    # Unchanged: conditional GET, nothing written
+    for run in ["cold", "unchanged"]:
+        adblock = DatabaseAdblock([base + "/hosts.txt"],
+                                  [base + "/easylist.txt"])
+        threads = set(enumerate_threads())
+        start = perf_counter()
+        # Lists are local, network monitor may report no network
+        adblock.update(force=True)
+        for thread in set(enumerate_threads()) - threads:
+            thread.join()
+        print("ingest %-15s %8.2f s  generation %d" %
+              (run, perf_counter() - start, adblock.get_generation()))
+    server.shutdown()
+
+
+def main():
+    """
+        Run benchmark
+    """
+    parser = ArgumentParser(description="Eolie adblock benchmark")
+    parser.add_argument("--hosts", type=int, default=100000,
+                        help="blocklist size (default 100000)")
+    parser.add_argument("--filters", type=int, default=20000,
+                        help="filters count (default 20000)")
+    parser.add_argument("--requests", type=int, default=100000,
+                        help="corpus size (default 100000)")
+    parser.add_argument("--corpus", help="replay corpus from file")
+    parser.add_argument("--save-corpus", help="save corpus to file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sqlite-requests", type=int, default=1000,
+                        help="corpus prefix replayed through the SQLite "
+                             "baseline, a full scan per request "
+                             "(default 1000)")
+    parser.add_argument("--no-ingest", action="store_true",
+                        help="skip ingest timing")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="eolie-benchmark-") as path:
+        setup_modules(path)
+        with tempfile.TemporaryDirectory(
+                prefix="eolie-benchmark-data-") as directory:
+            run(args, directory)
+
+
+def run(args, directory):
+    """
+        Run benchmark
+        @param args as argparse.Namespace
+        @param directory as str, for benchmark data
+    """
+    from eolie.adblock_index import AdblockIndex
+    from eolie.adblock_filters import AdblockFilters
+    rand = Random(args.seed)
+    start = perf_counter()
+    hosts = get_blocklist(rand, args.hosts)
+    filters = get_filters(rand, hosts, args.filters)
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = get_corpus(rand, hosts, args.requests)
+    if args.save_corpus:
+        save_corpus(args.save_corpus, corpus)
+    print("%d hosts, %d filters, %d requests, generated in %.2f s" %
+          (len(hosts), len(filters), len(corpus), perf_counter() - start))
+
+    start = perf_counter()
+    path = os.path.join(directory, "adblock.bin")
+    AdblockIndex.write(path, hosts, 1)
+    print("index compile %.2f s, %d bytes" %
+          (perf_counter() - start, os.path.getsize(path)))
+    index = AdblockIndex(path)
+    start = perf_counter()
+    path = os.path.join(directory, "adblock_filters.bin")
+    (count, scanned) = AdblockFilters.write(path, filters)
+    print("filters compile %.2f s, %d bytes, %d filters, "
+          "%d checked on every request" %
+          (perf_counter() - start, os.path.getsize(path), count, scanned))
+    start = perf_counter()
+    engine = AdblockFilters(path)
+    print("filters load %.4f s" % (perf_counter() - start))
+
+    if args.sqlite_requests > 0:
+        replay("sqlite (per request)",
+               get_sqlite_lookup(os.path.join(directory, "adblock.db"),
+                                 hosts),
+               corpus[:args.sqlite_requests])
+    replay("set + suffixes", get_suffixes_lookup(frozenset(hosts)), corpus)
+    replay("mmap index + suffixes", get_suffixes_lookup(index), corpus)
+    replay("filters", engine.is_blocked, corpus)
+    (lookup, adblock) = get_extension_lookup(hosts, filters)
+    if lookup is not None:
+        replay("extension (lru)", lookup, corpus)
+        (hits, misses, size) = adblock.get_cache_stats()
+        print("lru hits %d, misses %d, size %d" % (hits, misses, size))
+    if not args.no_ingest:
+        time_ingest(hosts, filters, directory)
+
+
+if __name__ == "__main__":
+    main()